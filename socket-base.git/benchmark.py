@@ -0,0 +1,178 @@
+
+"""
+compare the default asyncio event loop with uvloop on the same protocol workload
+
+    python benchmark.py --loops asyncio,uvloop --connections 50 --requests 2000 --pipeline 4
+
+every loop gets a fresh server process running ServerProtocol with the project routing table,
+the clients run on the default loop in this process, send auth frames and time each round trip,
+no redis is needed, the auth handler only answers
+"""
+
+import sys
+import time
+import json
+import asyncio
+import argparse
+import subprocess
+from collections import deque
+
+import router
+from main import install_event_loop
+from model.m_handler import HandlerFactory
+from model.m_protocol import ServerProtocol
+
+
+_MSGID = r'auth'
+
+
+def serve(loop_name, port):
+
+    HandlerFactory().load_settings(router.routing_table, router.route_ids, router.middleware)
+
+    loop_name = install_event_loop(loop_name)
+
+    loop = asyncio.get_event_loop()
+
+    server = loop.run_until_complete(loop.create_server(ServerProtocol, r'127.0.0.1', port))
+
+    # the parent waits for this line before it starts the clients
+    print(r'ready {}'.format(loop_name), flush=True)
+
+    try:
+        loop.run_forever()
+    finally:
+        server.close()
+        loop.close()
+
+
+def _build_frame():
+
+    b_content = json.dumps({r'token': r'benchmark'}).encode(r'utf-8')
+
+    header = {
+        r'content_type': r'json',
+        r'content_length': len(b_content),
+    }
+
+    return _MSGID.encode(r'utf-8') + b'\r\n' + json.dumps(header).encode(r'utf-8') + b'\r\n' + b_content
+
+
+@asyncio.coroutine
+def _read_frame(reader):
+
+    yield from reader.readuntil(b'\r\n')
+
+    b_header = yield from reader.readuntil(b'\r\n')
+
+    header = json.loads(b_header[:-2].decode(r'utf-8'))
+
+    yield from reader.readexactly(header[r'content_length'])
+
+
+@asyncio.coroutine
+def _run_client(port, requests, pipeline, latencies):
+
+    reader, writer = yield from asyncio.open_connection(r'127.0.0.1', port)
+
+    frame = _build_frame()
+
+    sent = deque()
+
+    remaining = requests
+
+    while remaining or sent:
+
+        while remaining and len(sent) < pipeline:
+            writer.write(frame)
+            sent.append(time.perf_counter())
+            remaining -= 1
+
+        yield from _read_frame(reader)
+
+        latencies.append(time.perf_counter() - sent.popleft())
+
+    writer.close()
+
+
+@asyncio.coroutine
+def _run_clients(port, connections, requests, pipeline):
+
+    latencies = []
+
+    start = time.perf_counter()
+
+    yield from asyncio.gather(*[_run_client(port, requests, pipeline, latencies) for _ in range(connections)])
+
+    elapsed = time.perf_counter() - start
+
+    return elapsed, latencies
+
+
+def _percentile(sorted_values, percent):
+
+    index = min(len(sorted_values) - 1, int(len(sorted_values) * percent / 100))
+
+    return sorted_values[index]
+
+
+def bench(loop_name, port, args):
+
+    proc = subprocess.Popen(
+        [sys.executable, __file__, r'--serve', loop_name, r'--port', str(port)],
+        stdout=subprocess.PIPE, universal_newlines=True
+    )
+
+    try:
+        ready = proc.stdout.readline().split()
+        if not ready or ready[0] != r'ready':
+            raise RuntimeError(r'server of {} did not start'.format(loop_name))
+
+        loop = asyncio.get_event_loop()
+
+        elapsed, latencies = loop.run_until_complete(
+            _run_clients(port, args.connections, args.requests, args.pipeline)
+        )
+
+    finally:
+        proc.terminate()
+        proc.wait()
+
+    latencies.sort()
+
+    return {
+        r'loop': ready[1],
+        r'requests': len(latencies),
+        r'seconds': elapsed,
+        r'throughput': len(latencies) / elapsed,
+        r'p50_ms': _percentile(latencies, 50) * 1000,
+        r'p99_ms': _percentile(latencies, 99) * 1000,
+    }
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=r'event loop benchmark of ServerProtocol')
+    parser.add_argument(r'--loops', default=r'asyncio,uvloop', help=r'comma separated loops to compare')
+    parser.add_argument(r'--connections', type=int, default=50)
+    parser.add_argument(r'--requests', type=int, default=2000, help=r'requests per connection')
+    parser.add_argument(r'--pipeline', type=int, default=4, help=r'requests in flight per connection')
+    parser.add_argument(r'--port', type=int, default=4990)
+    parser.add_argument(r'--serve', default=None, help=argparse.SUPPRESS)
+
+    args = parser.parse_args()
+
+    if args.serve is not None:
+        serve(args.serve, args.port)
+        return
+
+    print(r'{:<10}{:>10}{:>10}{:>14}{:>10}{:>10}'.format(r'loop', r'requests', r'seconds', r'req/s', r'p50 ms', r'p99 ms'))
+
+    for loop_name in args.loops.split(r','):
+        result = bench(loop_name, args.port, args)
+        print(r'{loop:<10}{requests:>10}{seconds:>10.2f}{throughput:>14.0f}{p50_ms:>10.3f}{p99_ms:>10.3f}'.format(**result))
+
+
+if __name__ == '__main__':
+
+    main()
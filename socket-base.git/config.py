@@ -8,15 +8,75 @@ Config = Const()
 Config.ServerHost = r'0.0.0.0'
 Config.ServerPort = 4900
 
+# worker processes sharing ServerPort through SO_REUSEPORT, 1 serves in the current process, 0 for one per cpu
+Config.WorkerNum = 1
+# a worker that dies sooner than this after spawning is respawned after the same delay
+Config.WorkerRespawnDelay = 1.0
+
+# asyncio or uvloop, uvloop falls back to asyncio when it is not installed
+Config.EventLoop = r'asyncio'
+
 Config.LogLevel = r'debug'
 Config.LogFilePath = r''
 
 Config.ProtocolBufferSize = 2048
 
+# frames smaller than this are never compressed
+Config.ProtocolCompressThreshold = 1024
+Config.ProtocolCompressLevel = 6
+# preset dictionary shared with clients for content_encoding deflate-dict, empty to disable
+Config.ProtocolCompressDict = b''
+# upper limit of an inflated request content
+Config.ProtocolInflateLimit = 16 * 1024 * 1024
+
+# transport write buffer water marks, pause_writing above high, resume_writing below low
+Config.ProtocolWriteHighWater = 256 * 1024
+Config.ProtocolWriteLowWater = 64 * 1024
+# frames held back while writing is paused, beyond this the overflow policy applies
+Config.ProtocolOutgoingLimit = 1024 * 1024
+# drop: discard new frames, disconnect: close the connection
+Config.ProtocolOverflowPolicy = r'drop'
+# reading pauses while this many requests of one connection wait or run
+Config.ProtocolMaxInflight = 64
+# body chunks a streaming route may buffer before reading pauses
+Config.ProtocolStreamBufferSize = 256 * 1024
+# content length limit of routes that do not set their own max_content_length
+Config.ProtocolMaxContentLength = 16 * 1024 * 1024
+# byte contents from this size on are spooled to a memory mapped temp file
+Config.ProtocolSpoolThreshold = 1024 * 1024
+# directory of the spool files, empty for the system temp directory
+Config.ProtocolSpoolDir = r''
+
+# resolution of the connection timers, in seconds
+Config.TimerWheelTick = 1.0
+# close connections that send nothing for this long, 0 to disable
+Config.ConnectionReadIdleTimeout = 180
+# ping connections that were sent nothing for this long, 0 to disable
+Config.ConnectionWriteIdlePing = 60
+# close connections that are not authenticated this long after connecting, 0 to disable
+Config.ConnectionAuthDeadline = 30
+Config.HeartbeatMsgid = r'ping'
+
+# handlers running at once over all connections, the other requests wait in the lane of their route
+Config.SchedulerConcurrency = 1024
+# seconds between two scheduler stats reports in the log
+Config.SchedulerReportInterval = 60
+# handlers running longer than this are cancelled, 0 to disable, routes may set their own r'timeout'
+Config.HandlerTimeout = 30
+# seconds a handler may go on after its connection is lost, routes may set their own r'grace'
+Config.HandlerCancelGrace = 0
+
 
 Config.RedisHost = (r'localhost', 6379)
 Config.RedisBase = 0
 Config.RedisMinConn = 32
 Config.RedisMaxConn = 128
 Config.RedisPasswd = None
+# batch the redis commands of one loop iteration into one pipeline on one connection
+Config.RedisAutoPipeline = False
+# entries of the in process cache in front of redis, 0 to disable, and their ttl in seconds
+Config.RedisLocalCacheSize = 0
+Config.RedisLocalCacheTTL = 5
+# redis connections leased longer than this are reported as leaked
+Config.RedisLeaseTimeout = 10
 
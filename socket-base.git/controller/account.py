@@ -6,10 +6,24 @@ from model.m_handler import BaseHandler
 
 class AuthAccount(BaseHandler):
 
+    stateless = True
+
     @asyncio.coroutine
     def run(self, conn, request):
 
-        conn.write_json(request[r'msgid'], {r'result': r'OK'})
+        content = request[r'content']
+
+        token = content.get(r'token', None) if isinstance(content, dict) else None
+
+        if not token:
+            conn.write_object(request[r'msgid'], {r'result': r'FAIL'}, request=request)
+            return
+
+        # account_info comes from the token once the account service is wired in,
+        # until then the token identifies the account
+        conn.bind_account(token, {r'token': token})
+
+        conn.write_object(request[r'msgid'], {r'result': r'OK'}, request=request)
 
 
 # auth (token, )
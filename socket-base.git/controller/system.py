@@ -0,0 +1,15 @@
+
+import asyncio
+
+from model.m_handler import BaseHandler
+
+
+class Heartbeat(BaseHandler):
+
+    stateless = True
+
+    @asyncio.coroutine
+    def run(self, conn, request):
+
+        # receiving the frame already refreshed the read idle timer of conn
+        pass
@@ -1,5 +1,7 @@
 
 import os
+import time
+import signal
 import asyncio
 
 import router
@@ -11,22 +13,31 @@ from service import Service
 from util.util import LoggerConfig, app_log
 
 
-def start():
+def install_event_loop(name):
+    """
+    install the event loop policy, returns the name of the loop actually in use
+    """
 
-    # is_linux = bool(platform.system() == r'Linux')
+    if name == r'uvloop':
+        try:
+            import uvloop
+        except ImportError:
+            app_log.warning(r'uvloop is not installed, fall back to asyncio')
+            return r'asyncio'
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+        asyncio.set_event_loop(asyncio.new_event_loop())
+        return r'uvloop'
 
-    # load router
-    HandlerFactory().load_settings(router.routing_table)
+    if name != r'asyncio':
+        app_log.warning(r'unknown event loop {}, fall back to asyncio'.format(name))
+
+    return r'asyncio'
 
-    # config logger
-    lc = LoggerConfig()
-    if Config.LogLevel:
-        lc.set_level(Config.LogLevel)
-    if Config.LogFilePath:
-        if not os.path.exists(Config.LogFilePath):
-            os.makedirs(Config.LogFilePath)
-        log_file_prefix = r'{}/all.log'.format(Config.LogFilePath)
-        lc.add_handler(Config.LogLevel, log_file_prefix, when=r'midnight', backupCount=Config.LogFileBackups)
+
+def serve(reuse_port=False):
+
+    # installed here, so every forked worker creates its own loop
+    loop_name = install_event_loop(Config.EventLoop)
 
     loop = asyncio.get_event_loop()
 
@@ -34,9 +45,10 @@ def start():
     loop.run_until_complete(initialize())
 
     # init
-    coro = loop.create_server(ServerProtocol, Config.ServerHost, Config.ServerPort)
+    coro = loop.create_server(ServerProtocol, Config.ServerHost, Config.ServerPort, reuse_port=reuse_port)
     server = loop.run_until_complete(coro)
-    app_log.info(r'Serving on {}'.format(server.sockets[0].getsockname()))
+    app_log.info(r'Serving on {} pid {} loop {}'.format(server.sockets[0].getsockname(), os.getpid(), loop_name))
+    loop.add_signal_handler(signal.SIGTERM, loop.stop)
     Service().run()
     try:
         loop.run_forever()
@@ -50,6 +62,99 @@ def start():
     app_log.info(r'Server closed')
 
 
+def supervise(worker_num):
+    """
+    fork worker_num workers, each binds ServerHost:ServerPort with SO_REUSEPORT
+    and owns its event loop, RedisPool and ConnectionManager, dead workers are respawned
+    """
+
+    # pid => spawn time
+    workers = {}
+    stopping = []
+
+    def spawn():
+        pid = os.fork()
+        if pid == 0:
+            # ctrl-c reaches the whole process group, only the supervisor handles it
+            signal.signal(signal.SIGINT, signal.SIG_IGN)
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            code = 0
+            try:
+                serve(reuse_port=True)
+            except Exception as e:
+                app_log.exception(r'worker {} error, {}'.format(os.getpid(), e))
+                code = 1
+            finally:
+                os._exit(code)
+        workers[pid] = time.time()
+        app_log.info(r'worker {} spawned'.format(pid))
+
+    def stop(signum, frame):
+        stopping.append(signum)
+        for pid in workers:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    for _ in range(worker_num):
+        spawn()
+
+    while workers:
+
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+
+        spawn_time = workers.pop(pid, None)
+        if spawn_time is None:
+            continue
+
+        if stopping:
+            app_log.info(r'worker {} exited'.format(pid))
+            continue
+
+        app_log.warning(r'worker {} died with status {}, respawn'.format(pid, status))
+
+        if time.time() - spawn_time < Config.WorkerRespawnDelay:
+            time.sleep(Config.WorkerRespawnDelay)
+
+        if not stopping:
+            spawn()
+
+    app_log.info(r'Supervisor closed')
+
+
+def start():
+
+    # is_linux = bool(platform.system() == r'Linux')
+
+    # load router
+    HandlerFactory().load_settings(router.routing_table, router.route_ids, router.middleware)
+
+    # config logger
+    lc = LoggerConfig()
+    if Config.LogLevel:
+        lc.set_level(Config.LogLevel)
+    if Config.LogFilePath:
+        if not os.path.exists(Config.LogFilePath):
+            os.makedirs(Config.LogFilePath)
+        log_file_prefix = r'{}/all.log'.format(Config.LogFilePath)
+        lc.add_handler(Config.LogLevel, log_file_prefix, when=r'midnight', backupCount=Config.LogFileBackups)
+
+    worker_num = Config.WorkerNum or os.cpu_count()
+
+    if worker_num > 1:
+        # fork before any event loop or redis pool exists, every worker creates its own
+        supervise(worker_num)
+    else:
+        serve()
+
+
 if __name__ == '__main__':
 
     start()
@@ -20,7 +20,10 @@ class RedisPool(Singleton, BaseRedisPool):
             r'password': Config.RedisPasswd
         }
 
-        BaseRedisPool.__init__(self, addr, settings)
+        BaseRedisPool.__init__(
+            self, addr, settings, Config.RedisAutoPipeline, Config.RedisLocalCacheSize, Config.RedisLocalCacheTTL,
+            Config.RedisLeaseTimeout
+        )
 
 
 class EventBus(Singleton, BaseEventBus):
@@ -36,3 +39,5 @@ class EventBus(Singleton, BaseEventBus):
 def initialize():
 
     yield from RedisPool().initialize()
+
+    yield from RedisPool().subscribe_invalidation(EventBus())
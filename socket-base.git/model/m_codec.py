@@ -0,0 +1,195 @@
+
+import json
+import zlib
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+from util.util import Singleton, Const
+from config import Config
+
+
+ContentType = Const()
+ContentType.Json = r'json'
+ContentType.String = r'string'
+ContentType.Byte = r'byte'
+ContentType.Msgpack = r'msgpack'
+
+
+ContentEncoding = Const()
+ContentEncoding.Deflate = r'deflate'
+ContentEncoding.DeflateDict = r'deflate-dict'
+
+
+class ContentEncodingError(Exception):
+    pass
+
+
+def _zdict(content_encoding):
+
+    if content_encoding == ContentEncoding.Deflate:
+        return None
+
+    if content_encoding == ContentEncoding.DeflateDict and Config.ProtocolCompressDict:
+        return Config.ProtocolCompressDict
+
+    raise ContentEncodingError(r'content encoding {} not supported'.format(content_encoding))
+
+
+def choose_content_encoding(accept_encoding):
+    """
+    pick the best encoding a client accepts, accept_encoding is a name or a list of names
+    """
+
+    if isinstance(accept_encoding, str):
+        accept_encoding = (accept_encoding,)
+    elif not isinstance(accept_encoding, (list, tuple)):
+        return None
+
+    if ContentEncoding.DeflateDict in accept_encoding and Config.ProtocolCompressDict:
+        return ContentEncoding.DeflateDict
+
+    if ContentEncoding.Deflate in accept_encoding:
+        return ContentEncoding.Deflate
+
+    return None
+
+
+def compress_content(content_encoding, b_data):
+
+    zdict = _zdict(content_encoding)
+
+    if zdict is None:
+        compressor = zlib.compressobj(Config.ProtocolCompressLevel)
+    else:
+        compressor = zlib.compressobj(Config.ProtocolCompressLevel, zdict=zdict)
+
+    return compressor.compress(b_data) + compressor.flush()
+
+
+def decompress_content(content_encoding, content_view, limit=None):
+    """
+    limit: upper limit of the inflated content, Config.ProtocolInflateLimit by default
+    """
+
+    if limit is None:
+        limit = Config.ProtocolInflateLimit
+
+    zdict = _zdict(content_encoding)
+
+    if zdict is None:
+        decompressor = zlib.decompressobj()
+    else:
+        decompressor = zlib.decompressobj(zdict=zdict)
+
+    try:
+        result = decompressor.decompress(content_view, limit)
+    except zlib.error as e:
+        raise ContentEncodingError(r'inflate error, {}'.format(e))
+
+    if decompressor.unconsumed_tail:
+        raise ContentEncodingError(r'inflated content exceeds {} bytes'.format(limit))
+
+    if not decompressor.eof:
+        raise ContentEncodingError(r'truncated deflate stream')
+
+    return result
+
+
+class BaseCodec(object):
+    """
+    content_type: name in the text frame header
+    code: content type byte of the binary frame header
+    structured: encodes dict/list payloads, so it can answer write_object
+    """
+
+    content_type = None
+    code = None
+    structured = False
+
+    def encode(self, data):
+        raise NotImplementedError()
+
+    def decode(self, content_view):
+        raise NotImplementedError()
+
+
+class JsonCodec(BaseCodec):
+
+    content_type = ContentType.Json
+    code = 1
+    structured = True
+
+    def encode(self, data):
+        return json.dumps(data).encode(r'utf-8')
+
+    def decode(self, content_view):
+        return json.loads(str(content_view, r'utf-8'))
+
+
+class StringCodec(BaseCodec):
+
+    content_type = ContentType.String
+    code = 2
+
+    def encode(self, data):
+        return data.encode(r'utf-8')
+
+    def decode(self, content_view):
+        return str(content_view, r'utf-8')
+
+
+class ByteCodec(BaseCodec):
+
+    content_type = ContentType.Byte
+    code = 3
+
+    def encode(self, data):
+        return data
+
+    def decode(self, content_view):
+        return content_view.tobytes()
+
+
+class MsgpackCodec(BaseCodec):
+
+    content_type = ContentType.Msgpack
+    code = 4
+    structured = True
+
+    def encode(self, data):
+        return msgpack.packb(data, use_bin_type=True)
+
+    def decode(self, content_view):
+        return msgpack.unpackb(content_view, raw=False)
+
+
+class CodecRegistry(Singleton):
+
+    def __init__(self):
+
+        # content_type => codec
+        self.codecs = {}
+        # binary content type code => content_type
+        self.content_types = {}
+
+    def register(self, codec):
+
+        self.codecs[codec.content_type] = codec
+        self.content_types[codec.code] = codec.content_type
+
+    def get(self, content_type):
+
+        return self.codecs.get(content_type, None)
+
+
+_registry = CodecRegistry()
+
+_registry.register(JsonCodec())
+_registry.register(StringCodec())
+_registry.register(ByteCodec())
+
+if msgpack is not None:
+    _registry.register(MsgpackCodec())
@@ -0,0 +1,468 @@
+
+import json
+import struct
+
+from .m_codec import CodecRegistry, ContentEncoding
+
+
+class ProtocolError(Exception):
+    pass
+
+
+# open_sink returns HOLD_FRAME to keep the frame in the parser,
+# the next call of next_frame offers the same frame to open_sink again
+HOLD_FRAME = object()
+
+
+_STAGE_MSGID = 0
+_STAGE_HEADER = 1
+_STAGE_CONTENT = 2
+_STAGE_PREFACE = 3
+_STAGE_SINK = 4
+_STAGE_REQUEST_ID = 5
+# the head is parsed, open_sink has not taken the frame yet
+_STAGE_OPEN = 6
+
+_DELIMITER = b'\r\n'
+
+# a binary client opens the connection with this preface,
+# 0xff never starts an utf-8 msgid, so the first byte is enough to tell the modes apart
+BINARY_PREFACE = b'\xffSB\x01'
+
+# route_id(u16) content_type(u8) flags(u8) content_length(u32)
+# with _FLAG_REQUEST_ID, request_id(u32) follows the header
+# route_id 0 means the msgid is sent inline: msgid_length(u8) msgid, right after the header and request_id
+_BINARY_HEADER = struct.Struct(r'!HBBI')
+_REQUEST_ID = struct.Struct(r'!I')
+
+# request ids are u32 in both modes, so a client can switch modes without changing them
+MAX_REQUEST_ID = 0xffffffff
+
+_INLINE_ROUTE_ID = 0
+
+# flags of the binary frame header
+_FLAG_DEFLATE = 0x01
+_FLAG_DEFLATE_DICT = 0x02
+# the client accepts compressed frames
+_FLAG_ACCEPT_DEFLATE = 0x04
+_FLAG_ACCEPT_DEFLATE_DICT = 0x08
+# a request_id follows the header
+_FLAG_REQUEST_ID = 0x10
+
+_ENCODING_FLAGS = {
+    ContentEncoding.Deflate: _FLAG_DEFLATE,
+    ContentEncoding.DeflateDict: _FLAG_DEFLATE_DICT,
+}
+
+_codecs = CodecRegistry()
+
+
+def _flags_to_header(flags, header):
+
+    if flags & _FLAG_DEFLATE_DICT:
+        header[r'content_encoding'] = ContentEncoding.DeflateDict
+    elif flags & _FLAG_DEFLATE:
+        header[r'content_encoding'] = ContentEncoding.Deflate
+
+    if flags & (_FLAG_ACCEPT_DEFLATE | _FLAG_ACCEPT_DEFLATE_DICT):
+        accept_encoding = []
+        if flags & _FLAG_ACCEPT_DEFLATE_DICT:
+            accept_encoding.append(ContentEncoding.DeflateDict)
+        if flags & _FLAG_ACCEPT_DEFLATE:
+            accept_encoding.append(ContentEncoding.Deflate)
+        header[r'accept_encoding'] = accept_encoding
+
+
+def is_binary_preface(data):
+
+    return data[:1] == BINARY_PREFACE[:1]
+
+
+def pack_text_head(msgid, header):
+    """
+    everything before the content, encoded at once
+    the content itself is not copied, it is written right after the head
+    """
+
+    return (msgid + '\r\n' + json.dumps(header) + '\r\n').encode(r'utf-8')
+
+
+def pack_binary_head(msgid, header, route_ids):
+
+    route_id = route_ids.get(msgid, _INLINE_ROUTE_ID)
+
+    type_code = _codecs.get(header[r'content_type']).code
+    flags = _ENCODING_FLAGS.get(header.get(r'content_encoding', None), 0)
+    content_length = header[r'content_length']
+    request_id = header.get(r'request_id', None)
+
+    if route_id != _INLINE_ROUTE_ID and request_id is None:
+        return _BINARY_HEADER.pack(route_id, type_code, flags, content_length)
+
+    size = _BINARY_HEADER.size
+
+    if request_id is not None:
+        flags |= _FLAG_REQUEST_ID
+        size += _REQUEST_ID.size
+
+    if route_id == _INLINE_ROUTE_ID:
+        b_msgid = msgid.encode(r'utf-8')
+    else:
+        b_msgid = None
+
+    b_head = bytearray(size + (0 if b_msgid is None else 1 + len(b_msgid)))
+    _BINARY_HEADER.pack_into(b_head, 0, route_id, type_code, flags, content_length)
+
+    if request_id is not None:
+        _REQUEST_ID.pack_into(b_head, _BINARY_HEADER.size, request_id)
+
+    if b_msgid is not None:
+        struct.pack_into(r'!B', b_head, size, len(b_msgid))
+        b_head[size + 1:] = b_msgid
+
+    return b_head
+
+
+class _FrameParser(object):
+
+    def __init__(self, open_sink=None):
+
+        self._buffer = bytearray()
+        # start of the unconsumed data
+        self._offset = 0
+
+        self._stage = None
+        self._msgid = None
+        self._header = None
+        self._content_length = 0
+
+        # open_sink(msgid, header) is called once the head of a frame is parsed,
+        # it returns a sink taking the content as it arrives, None to buffer the content here,
+        # or HOLD_FRAME to keep the frame for a later next_frame
+        self._open_sink = open_sink
+        self._sink = None
+        self._sink_remaining = 0
+
+    def buffered_size(self):
+
+        return len(self._buffer) - self._offset
+
+    def feed(self, data):
+        """
+        content views returned by next_frame must be released before feeding more data
+        """
+
+        if self._offset:
+            # bytearray drops its head without moving the tail
+            self._consumed(self._offset)
+            del self._buffer[:self._offset]
+            self._offset = 0
+
+        self._buffer += data
+
+    def _consumed(self, size):
+
+        pass
+
+    def _parse_head(self):
+        """
+        parse msgid and header, returns True once self._msgid, self._header, self._content_length are set
+        """
+
+        raise NotImplementedError()
+
+    def _frame_done(self):
+
+        self._msgid = self._header = None
+        self._content_length = 0
+
+    def _pump_sink(self):
+        """
+        move the buffered part of the content into the sink, returns True when the content is complete
+
+        the chunk given to sink.feed is a memoryview into the buffer, valid during the call only
+        """
+
+        size = min(len(self._buffer) - self._offset, self._sink_remaining)
+
+        if size:
+            start = self._offset
+            with memoryview(self._buffer) as view:
+                chunk = view[start:start + size]
+                self._sink.feed(chunk)
+                chunk.release()
+            self._offset += size
+            self._sink_remaining -= size
+
+        if self._sink_remaining:
+            return False
+
+        sink, self._sink = self._sink, None
+        sink.feed_eof()
+
+        return True
+
+    def next_frame(self):
+        """
+        returns (msgid, header, content_view) or None if the frame is not complete yet
+
+        content_view is a memoryview into the parser buffer, the caller decodes it and releases it
+        content taken by a sink goes there as it arrives and is never returned here
+        """
+
+        while True:
+
+            if self._stage != _STAGE_CONTENT and self._stage != _STAGE_SINK:
+
+                if self._stage != _STAGE_OPEN:
+                    if not self._parse_head():
+                        return None
+                    self._stage = _STAGE_OPEN
+
+                sink = None
+                if self._open_sink is not None:
+                    sink = self._open_sink(self._msgid, self._header)
+                    if sink is HOLD_FRAME:
+                        return None
+
+                if sink is None:
+                    self._stage = _STAGE_CONTENT
+                else:
+                    self._sink = sink
+                    self._sink_remaining = self._content_length
+                    self._stage = _STAGE_SINK
+
+            if self._stage == _STAGE_SINK:
+
+                if not self._pump_sink():
+                    return None
+
+                self._frame_done()
+                continue
+
+            start = self._offset
+            end = start + self._content_length
+
+            if len(self._buffer) < end:
+                return None
+
+            self._offset = end
+
+            frame = (self._msgid, self._header, memoryview(self._buffer)[start:end])
+
+            self._frame_done()
+
+            return frame
+
+
+class TextFrameParser(_FrameParser):
+    """
+    incremental parser of the text frame protocol
+
+    frame = msgid \r\n json_header \r\n content
+
+    bytes are appended to one bytearray, the parser remembers its stage and where
+    the last delimiter scan stopped, so every received byte is scanned only once
+    """
+
+    def __init__(self, line_limit, open_sink=None):
+
+        super().__init__(open_sink)
+
+        # position where the delimiter scan resumes
+        self._scan = 0
+        self._stage = _STAGE_MSGID
+        self._line_limit = line_limit
+
+    def _consumed(self, size):
+
+        self._scan -= size
+
+    def _find_line(self, error):
+
+        buffer = self._buffer
+
+        pos = buffer.find(_DELIMITER, self._scan)
+
+        if pos == -1:
+            if len(buffer) - self._offset >= self._line_limit:
+                raise ProtocolError(error)
+            # keep the last byte, it may be the first half of the delimiter
+            self._scan = max(self._offset, len(buffer) - 1)
+            return None
+
+        line = buffer[self._offset:pos]
+
+        self._offset = self._scan = pos + 2
+
+        return line
+
+    def _frame_done(self):
+
+        super()._frame_done()
+
+        self._scan = self._offset
+        self._stage = _STAGE_MSGID
+
+    def _parse_head(self):
+
+        if self._stage == _STAGE_MSGID:
+
+            b_msgid = self._find_line(r'no msgid within buffer size')
+            if b_msgid is None:
+                return False
+
+            try:
+                self._msgid = b_msgid.decode(r'utf-8')
+            except UnicodeDecodeError as e:
+                raise ProtocolError(r'msgid decode error, {}'.format(e))
+
+            self._stage = _STAGE_HEADER
+
+        b_header = self._find_line(r'no header within buffer size')
+        if b_header is None:
+            return False
+
+        try:
+            header = json.loads(b_header.decode(r'utf-8'))
+        except Exception as e:
+            raise ProtocolError(r'parse header failed, {}'.format(e))
+
+        # header = {
+        #     r'content_type': r'json', fixed
+        #     r'content_length': 1024, fixed
+        #     r'request_id': 1, optional, echoed in the response
+        #     r'_': 0,
+        # }
+        try:
+            content_type = header[r'content_type']
+            content_length = header[r'content_length']
+        except (KeyError, TypeError) as e:
+            raise ProtocolError(r'header error, {}'.format(e))
+
+        if not isinstance(content_type, str):
+            raise ProtocolError(r'header error, bad content_type {}'.format(content_type))
+
+        if not isinstance(content_length, int) or content_length < 0:
+            raise ProtocolError(r'header error, bad content_length {}'.format(content_length))
+
+        self._header = header
+        self._content_length = content_length
+
+        return True
+
+
+class BinaryFrameParser(_FrameParser):
+    """
+    incremental parser of the binary frame protocol
+
+    connection = preface frame frame ...
+    frame = fixed size header [inline msgid] content
+
+    the header is unpacked with struct, no json and no delimiter scanning per frame
+    """
+
+    def __init__(self, route_names, open_sink=None):
+
+        super().__init__(open_sink)
+
+        self._stage = _STAGE_PREFACE
+        # route_id => msgid
+        self._route_names = route_names
+        # content type code => content_type
+        self._content_types = _codecs.content_types
+
+        self._content_type = None
+        self._flags = 0
+        self._request_id = None
+
+    def _frame_done(self):
+
+        super()._frame_done()
+
+        self._content_type = None
+        self._flags = 0
+        self._request_id = None
+        self._stage = _STAGE_HEADER
+
+    def _parse_head(self):
+
+        buffer = self._buffer
+
+        if self._stage == _STAGE_PREFACE:
+
+            if len(buffer) - self._offset < len(BINARY_PREFACE):
+                return False
+
+            if buffer[self._offset:self._offset + len(BINARY_PREFACE)] != BINARY_PREFACE:
+                raise ProtocolError(r'bad binary preface')
+
+            self._offset += len(BINARY_PREFACE)
+            self._stage = _STAGE_HEADER
+
+        if self._stage == _STAGE_HEADER:
+
+            if len(buffer) - self._offset < _BINARY_HEADER.size:
+                return False
+
+            route_id, type_code, flags, content_length = _BINARY_HEADER.unpack_from(buffer, self._offset)
+
+            content_type = self._content_types.get(type_code, None)
+            if content_type is None:
+                raise ProtocolError(r'content type not supported')
+
+            self._offset += _BINARY_HEADER.size
+            self._content_type = content_type
+            self._content_length = content_length
+            self._flags = flags
+
+            if route_id != _INLINE_ROUTE_ID:
+                msgid = self._route_names.get(route_id, None)
+                if msgid is None:
+                    raise ProtocolError(r'route id {} not found'.format(route_id))
+                self._msgid = msgid
+
+            self._stage = _STAGE_REQUEST_ID if flags & _FLAG_REQUEST_ID else _STAGE_MSGID
+
+        if self._stage == _STAGE_REQUEST_ID:
+
+            if len(buffer) - self._offset < _REQUEST_ID.size:
+                return False
+
+            self._request_id = _REQUEST_ID.unpack_from(buffer, self._offset)[0]
+            self._offset += _REQUEST_ID.size
+            self._stage = _STAGE_MSGID
+
+        if self._stage == _STAGE_MSGID and self._msgid is None:
+
+            if len(buffer) - self._offset < 1:
+                return False
+
+            msgid_length = buffer[self._offset]
+
+            if len(buffer) - self._offset - 1 < msgid_length:
+                return False
+
+            start = self._offset + 1
+
+            try:
+                self._msgid = buffer[start:start + msgid_length].decode(r'utf-8')
+            except UnicodeDecodeError as e:
+                raise ProtocolError(r'msgid decode error, {}'.format(e))
+
+            self._offset = start + msgid_length
+
+        header = {
+            r'content_type': self._content_type,
+            r'content_length': self._content_length,
+        }
+
+        if self._flags:
+            _flags_to_header(self._flags, header)
+
+        if self._request_id is not None:
+            header[r'request_id'] = self._request_id
+
+        self._header = header
+
+        return True
@@ -2,6 +2,69 @@
 import asyncio
 
 from util.util import Singleton
+from config import Config
+
+from .m_ratelimit import RateLimit
+from .m_scheduler import Priority
+
+
+class Route(object):
+    """
+    dispatch entry of a msgid, compiled once by HandlerFactory.load_settings
+
+    route.handle(conn, request) returns the coroutine serving the request,
+    a stateless handler is created once and shared, the others get a new instance per request
+
+    the middleware of the route is folded into route.handle here, the outermost first:
+        middleware(route, handle) returns the handle wrapping handle, or handle itself to skip this route
+    a route without middleware calls the handler directly
+    """
+
+    __slots__ = (
+        r'msgid', r'route_id', r'handler_class', r'options', r'handle',
+        r'streaming', r'max_content_length', r'rate_limit', r'priority', r'timeout', r'grace',
+    )
+
+    def __init__(self, msgid, handler_class, route_id=None, options=None, middleware=()):
+
+        self.msgid = msgid
+        self.route_id = route_id
+        self.handler_class = handler_class
+        self.options = options or {}
+
+        self.streaming = handler_class.streaming
+
+        if handler_class.max_content_length is None:
+            self.max_content_length = Config.ProtocolMaxContentLength
+        else:
+            self.max_content_length = handler_class.max_content_length
+
+        if r'rate_limit' in self.options:
+            self.rate_limit = RateLimit(msgid, self.options[r'rate_limit'])
+        else:
+            self.rate_limit = None
+
+        self.priority = self.options.get(r'priority', Priority.Normal)
+        self.timeout = self.options.get(r'timeout', Config.HandlerTimeout)
+        self.grace = self.options.get(r'grace', Config.HandlerCancelGrace)
+
+        if handler_class.stateless:
+            handle = handler_class().handle
+        else:
+            handle = self._handle_new
+
+        chain = list(middleware)
+        chain.extend(handler_class.middleware)
+        chain.extend(self.options.get(r'middleware', ()))
+
+        for item in reversed(chain):
+            handle = item(self, handle)
+
+        self.handle = handle
+
+    def _handle_new(self, conn, request):
+
+        return self.handler_class().handle(conn, request)
 
 
 class HandlerFactory(Singleton):
@@ -9,18 +72,72 @@ class HandlerFactory(Singleton):
     def __init__(self):
 
         self.routing_table = {}
-
-    def load_settings(self, routing_table):
+        # msgid => Route
+        self.routes = {}
+        # interned route ids of the binary frame protocol
+        self.route_ids = {}
+        self.route_names = {}
+
+        # middleware of every route, outside the middleware of the route itself
+        self.middleware = []
+
+    def load_settings(self, routing_table, route_ids=None, middleware=None):
+        """
+        routing_table: msgid => handler_class, or msgid => (handler_class, options)
+        options: {
+            r'middleware': [middleware, ...],
+            r'rate_limit': {...}, see RateLimit
+            r'priority': Priority.Normal, scheduler lane of the route
+            r'timeout': 30, seconds before the handler is cancelled, 0 for none
+            r'grace': 0, seconds the handler may go on after its connection is lost
+        }
+        """
 
         self.routing_table = routing_table
 
+        if route_ids is not None:
+            self.route_ids = route_ids
+            self.route_names = {route_id: msgid for msgid, route_id in route_ids.items()}
+
+        if middleware is not None:
+            self.middleware = list(middleware)
+
+        routes = {}
+
+        for msgid, target in routing_table.items():
+
+            if isinstance(target, tuple):
+                handler_class, options = target
+            else:
+                handler_class, options = target, None
+
+            routes[msgid] = Route(msgid, handler_class, self.route_ids.get(msgid, None), options, self.middleware)
+
+        self.routes = routes
+
     def __call__(self, msgid):
 
-        return self.routing_table.get(msgid, None)
+        route = self.routes.get(msgid, None)
+
+        return None if route is None else route.handler_class
 
 
 class BaseHandler(object):
 
+    # a streaming handler gets request['content'] as a BodyStream of raw content chunks,
+    # it runs as soon as the header arrives instead of after the whole content
+    streaming = False
+
+    # content length limit of this route, None for Config.ProtocolMaxContentLength
+    max_content_length = None
+
+    # middleware of this handler, inside the global middleware and outside the route options middleware
+    middleware = ()
+
+    # a stateless handler keeps nothing on self between prepare, run and finish,
+    # one instance then serves every request of the route
+    stateless = False
+
     @asyncio.coroutine
     def prepare(self, conn, request):
         pass
@@ -35,5 +152,11 @@ class BaseHandler(object):
 
     @asyncio.coroutine
     def handle(self, conn, request):
-        yield from self.prepare(conn, request)
-        yield from self.run(conn, request)
+        """
+        prepare, run, then finish, finish runs even if prepare or run raised
+        """
+        try:
+            yield from self.prepare(conn, request)
+            yield from self.run(conn, request)
+        finally:
+            yield from self.finish(conn, request)
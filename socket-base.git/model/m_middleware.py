@@ -0,0 +1,54 @@
+
+import time
+import asyncio
+
+from util.util import app_log
+
+
+def require_auth(route, handle):
+    """
+    close connections calling the route before they are authenticated,
+    routes with the option r'anonymous': True are left alone
+    """
+
+    if route.options.get(r'anonymous', False):
+        return handle
+
+    msgid = route.msgid
+
+    @asyncio.coroutine
+    def _handle(conn, request):
+
+        if not conn.authenticated:
+            conn.close(r'msgid {} requires authentication'.format(msgid))
+            return
+
+        yield from handle(conn, request)
+
+    return _handle
+
+
+def slow_log(threshold):
+    """
+    warn about requests of the route running longer than threshold seconds
+    """
+
+    def _middleware(route, handle):
+
+        msgid = route.msgid
+
+        @asyncio.coroutine
+        def _handle(conn, request):
+
+            start = time.monotonic()
+
+            try:
+                yield from handle(conn, request)
+            finally:
+                elapsed = time.monotonic() - start
+                if elapsed >= threshold:
+                    app_log.warning(r'handle {} took {:.3f}s'.format(msgid, elapsed))
+
+        return _handle
+
+    return _middleware
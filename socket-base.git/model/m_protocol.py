@@ -1,12 +1,37 @@
 
 import asyncio
-import copy
-import json
+import mmap
+import tempfile
+from collections import deque
 
 from util.util import Singleton, app_log, Const
+from util.timer import TimerWheel
 from config import Config
 
 from .m_handler import HandlerFactory
+from .m_ratelimit import RateLimitPolicy
+from .m_scheduler import RequestScheduler
+from .m_codec import ContentType, CodecRegistry, ContentEncodingError
+from .m_codec import choose_content_encoding, compress_content, decompress_content
+from .m_frame import ProtocolError, TextFrameParser, BinaryFrameParser, MAX_REQUEST_ID, HOLD_FRAME
+from .m_frame import is_binary_preface, pack_text_head, pack_binary_head
+
+
+# singletons looked up once, not through the metaclass for every frame
+_handlers = HandlerFactory()
+_codecs = CodecRegistry()
+_scheduler = RequestScheduler()
+
+try:
+    _current_task = asyncio.current_task
+except AttributeError:
+    _current_task = asyncio.Task.current_task
+
+
+GroupType = Const()
+GroupType.Account = r'account'
+GroupType.Room = r'room'
+GroupType.Tag = r'tag'
 
 
 class ConnectionManager(Singleton):
@@ -15,21 +40,374 @@ class ConnectionManager(Singleton):
 
         self.connections = {}
 
+        # (group_type, group_id) => set of connections
+        self.groups = {}
+
+        # one wheel drives the idle, heartbeat and auth timers of all connections
+        self.timer_wheel = TimerWheel(Config.TimerWheelTick)
+
     def add_connection(self, session, connection):
 
         self.connections[session] = connection
 
+        wheel = self.timer_wheel
+
+        connection.read_tick = connection.write_tick = wheel.current
+
+        if Config.ConnectionReadIdleTimeout:
+            connection.idle_timer = wheel.arm(Config.ConnectionReadIdleTimeout, self._check_read_idle, connection)
+
+        if Config.ConnectionWriteIdlePing:
+            connection.ping_timer = wheel.arm(Config.ConnectionWriteIdlePing, self._check_write_idle, connection)
+
+        if Config.ConnectionAuthDeadline and not connection.authenticated:
+            connection.auth_timer = wheel.arm(Config.ConnectionAuthDeadline, self._check_auth, connection)
+
     def remove_connection(self, session):
 
-        if session in self.connections:
-            del self.connections[session]
+        connection = self.connections.pop(session, None)
+
+        if connection is None:
+            return
+
+        for group in connection.groups:
+            members = self.groups.get(group, None)
+            if members is not None:
+                members.discard(connection)
+                if not members:
+                    del self.groups[group]
+
+        connection.groups = set()
+
+        for timer in (connection.idle_timer, connection.ping_timer, connection.auth_timer):
+            if timer is not None:
+                timer.cancel()
+
+        connection.idle_timer = connection.ping_timer = connection.auth_timer = None
+
+    def join(self, connection, group_type, group_id):
+
+        if self.connections.get(connection.session, None) is not connection:
+            # removed already, a handler still running after connection_lost must not index it again
+            return
+
+        group = (group_type, group_id)
+
+        members = self.groups.get(group, None)
+
+        if members is None:
+            members = self.groups[group] = set()
+
+        members.add(connection)
+        connection.groups.add(group)
+
+    def leave(self, connection, group_type, group_id):
+
+        group = (group_type, group_id)
+
+        connection.groups.discard(group)
+
+        members = self.groups.get(group, None)
+
+        if members is None:
+            return
+
+        members.discard(connection)
+
+        if not members:
+            del self.groups[group]
+
+    def get_group(self, group_type, group_id):
+        """
+        the members set is live, copy it before joining or leaving while iterating
+        """
+
+        return self.groups.get((group_type, group_id), frozenset())
+
+    def get_account_connections(self, account_id):
+
+        return self.get_group(GroupType.Account, account_id)
+
+    def get_room_connections(self, room_id):
+
+        return self.get_group(GroupType.Room, room_id)
+
+    def kick_account(self, account_id, reason=None):
+
+        for connection in list(self.get_account_connections(account_id)):
+            connection.close(reason)
+
+    def broadcast(self, targets, msgid, payload, content_type=ContentType.Json):
+        """
+        send one message to many connections, it is encoded and framed once per wire format
+        (text / binary, content encoding) instead of once per connection
+
+        connections that are closed or paused by flow control are skipped,
+        returns the number of connections written to
+        """
+
+        codec = _codecs.get(content_type)
+
+        if codec is None:
+            app_log.error(r'broadcast {} error, content type not supported'.format(content_type))
+            return 0
+
+        try:
+            b_data = codec.encode(payload)
+        except Exception as e:
+            app_log.exception(r'broadcast {} error, {}'.format(content_type, e))
+            return 0
+
+        # (binary, content_encoding) => (b_head, b_data)
+        frames = {}
+
+        count = 0
+
+        for connection in targets:
+
+            transport = connection.transport
+
+            if transport is None or transport.is_closing() or connection.writing_paused:
+                continue
+
+            key = (connection.binary, connection.content_encoding)
+
+            frame = frames.get(key, None)
+
+            if frame is None:
+
+                header = {
+                    r'content_type': content_type,
+                    r'content_length': len(b_data),
+                }
+
+                try:
+                    frame = frames[key] = pack_frame(msgid, header, b_data, *key)
+                except Exception as e:
+                    app_log.exception(r'broadcast pack data error, {}'.format(e))
+                    return count
+
+            connection._push(*frame)
+
+            count += 1
+
+        return count
+
+    def _check_read_idle(self, connection):
+
+        # activity only stamps read_tick, the timer is moved when it fires
+        wheel = self.timer_wheel
+
+        remaining = connection.read_tick + wheel.ticks(Config.ConnectionReadIdleTimeout) - wheel.current
+
+        if remaining > 0:
+            wheel.rearm(connection.idle_timer, remaining * wheel.tick)
+        else:
+            connection.close(r'read idle timeout')
+
+    def _check_write_idle(self, connection):
+
+        wheel = self.timer_wheel
+
+        remaining = connection.write_tick + wheel.ticks(Config.ConnectionWriteIdlePing) - wheel.current
+
+        if remaining > 0:
+            wheel.rearm(connection.ping_timer, remaining * wheel.tick)
+        else:
+            connection.ping()
+            wheel.rearm(connection.ping_timer, Config.ConnectionWriteIdlePing)
+
+    def _check_auth(self, connection):
+
+        connection.auth_timer = None
+
+        if not connection.authenticated:
+            connection.close(r'not authenticated within {} seconds'.format(Config.ConnectionAuthDeadline))
+
+
+def pack_frame(msgid, header, b_data, binary, content_encoding):
+    """
+    returns (b_head, b_data) of a frame, b_data is compressed when content_encoding is given and it pays off
+    """
+
+    if content_encoding is not None and len(b_data) >= Config.ProtocolCompressThreshold:
+        b_deflated = compress_content(content_encoding, b_data)
+        if len(b_deflated) < len(b_data):
+            b_data = b_deflated
+            header[r'content_encoding'] = content_encoding
+            header[r'content_length'] = len(b_data)
+
+    if binary:
+        b_head = pack_binary_head(msgid, header, _handlers.route_ids)
+    else:
+        b_head = pack_text_head(msgid, header)
+
+    return b_head, b_data
+
+
+OverflowPolicy = Const()
+OverflowPolicy.Drop = r'drop'
+OverflowPolicy.Disconnect = r'disconnect'
+
+
+_PAUSE_INFLIGHT = r'inflight'
+_PAUSE_RATE_LIMIT = r'rate_limit'
+
+
+class BodyStream(object):
+    """
+    content of a streaming route, it is request['content'] before the content arrives
+
+        chunk = yield from stream.read()    # b'' at the end of the content
+
+        async for chunk in stream:
+            ...
+
+    reading of the connection pauses while too many chunks wait to be read
+    """
+
+    def __init__(self, protocol, content_length):
+
+        self.content_length = content_length
+        self._protocol = protocol
+        self._chunks = deque()
+        self._size = 0
+        self._eof = False
+        self._discarded = False
+        self._exception = None
+        self._waiter = None
+
+    def at_eof(self):
+
+        return self._eof and not self._chunks
+
+    def feed(self, chunk):
+
+        if self._discarded:
+            return
+
+        self._chunks.append(chunk.tobytes())
+        self._size += len(chunk)
+
+        if self._size >= Config.ProtocolStreamBufferSize:
+            self._protocol.pause_reading_for(self)
+
+        self._wakeup()
+
+    def feed_eof(self):
+
+        self._eof = True
+        self._wakeup()
+
+    def set_exception(self, exc):
+
+        self._exception = exc
+        self._wakeup()
+
+    def discard(self):
+        """
+        the handler is done, the rest of the content is dropped as it arrives
+        """
+
+        self._discarded = True
+        self._chunks.clear()
+        self._size = 0
+        self._protocol.resume_reading_for(self)
+
+    def _wakeup(self):
+
+        waiter, self._waiter = self._waiter, None
 
+        if waiter is not None and not waiter.done():
+            waiter.set_result(None)
 
+    @asyncio.coroutine
+    def read(self):
 
-ContentType = Const()
-ContentType.Json = r'json'
-ContentType.String = r'string'
-ContentType.Byte = r'byte'
+        while not self._chunks:
+
+            if self._exception is not None:
+                raise self._exception
+
+            if self._eof:
+                return b''
+
+            self._waiter = asyncio.Future()
+            yield from self._protocol.wait_client(self._waiter)
+
+        chunk = self._chunks.popleft()
+        self._size -= len(chunk)
+
+        if self._size < Config.ProtocolStreamBufferSize // 2:
+            self._protocol.resume_reading_for(self)
+
+        return chunk
+
+    def __aiter__(self):
+
+        return self
+
+    @asyncio.coroutine
+    def __anext__(self):
+
+        chunk = yield from self.read()
+
+        if not chunk:
+            raise StopAsyncIteration
+
+        return chunk
+
+
+class _DiscardSink(object):
+    """
+    swallows the content of a frame that is dropped
+    """
+
+    def feed(self, chunk):
+
+        pass
+
+    def feed_eof(self):
+
+        pass
+
+
+_discard_sink = _DiscardSink()
+
+
+class SpoolSink(object):
+    """
+    writes a large byte content to an anonymous temp file as it arrives,
+    the handler gets request['content'] as a memoryview over the memory mapped file
+    """
+
+    def __init__(self, protocol, route, request):
+
+        self._protocol = protocol
+        self._route = route
+        self._request = request
+        self._file = tempfile.TemporaryFile(dir=Config.ProtocolSpoolDir or None)
+
+    def feed(self, chunk):
+
+        self._file.write(chunk)
+
+    def feed_eof(self):
+
+        try:
+            self._file.flush()
+            spool = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        finally:
+            # the mapping outlives the file, it is unmapped when the request is gone
+            self._file.close()
+
+        self._request[r'content'] = memoryview(spool)
+        self._protocol.spool_done(self)
+        self._protocol.enqueue_request(self._route, self._request)
+
+    def abort(self):
+
+        self._file.close()
 
 
 class ServerProtocol(asyncio.Protocol):
@@ -41,142 +419,497 @@ class ServerProtocol(asyncio.Protocol):
         self.client_port = 0
         self.session = r''
         self.authenticated = False
+        self.account_id = None
         self.account_info = None
-        self.buffer = b''
+        # (group_type, group_id) this connection is indexed under in ConnectionManager
+        self.groups = set()
+        # text or binary frame protocol, chosen by the first bytes the client sends
+        self.binary = False
+        self.parser = None
+        self.content_type = ContentType.Json
+        # content encoding of outgoing frames, None until the client accepts one
+        self.content_encoding = None
+        # frames written during one loop iteration, flushed together
+        self._outgoing = []
+        self._outgoing_size = 0
+        # flow control
+        self.writing_paused = False
+        # reasons reading is paused for, it resumes when all of them are gone
+        self._read_pauses = set()
+        self._drain_handle = None
+        self._drain_waiters = []
+        # sink of the content being received, a BodyStream or a SpoolSink
+        self._sink = None
+        self._requests = deque()
+        self._runner = None
+        # task => route of the handler it is running, None while it runs none
+        self._tasks = {}
+        # tasks whose handler gave its scheduler slot back while it waits on the client
+        self._client_waits = set()
+        # msgid => TokenBucket of the rate limited routes
+        self.rate_buckets = {}
+        self._rate_limit_handle = None
+        # timer wheel ticks of the latest read and write, idle timers check them when they fire
+        self._timer_wheel = None
+        self.read_tick = 0
+        self.write_tick = 0
+        self.idle_timer = None
+        self.ping_timer = None
+        self.auth_timer = None
 
     def connection_made(self, transport):
         self.transport = transport
         self.client_host, self.client_port = self.transport.get_extra_info(r'peername')
         self.session = r'session_{}_{}'.format(self.client_host, self.client_port)
-        ConnectionManager().add_connection(self.session, self)
+        self.transport.set_write_buffer_limits(Config.ProtocolWriteHighWater, Config.ProtocolWriteLowWater)
+        manager = ConnectionManager()
+        self._timer_wheel = manager.timer_wheel
+        manager.add_connection(self.session, self)
         app_log.info(r'connection {}:{} made'.format(self.client_host, self.client_port))
 
     def connection_lost(self, exc):
         ConnectionManager().remove_connection(self.session)
+        self._outgoing = []
+        self._outgoing_size = 0
+        self._wakeup_drain_waiters()
+        if self._rate_limit_handle is not None:
+            self._rate_limit_handle.cancel()
+            self._rate_limit_handle = None
+        if self._drain_handle is not None:
+            self._drain_handle.cancel()
+            self._drain_handle = None
+        self._cancel_tasks()
+        sink, self._sink = self._sink, None
+        if isinstance(sink, BodyStream):
+            if not sink.at_eof():
+                sink.set_exception(ConnectionResetError(r'connection lost'))
+        elif sink is not None:
+            sink.abort()
         if exc is not None:
             app_log.warning(r'connection lost exc: {}'.format(exc))
         app_log.info(r'connection {}:{} lost'.format(self.client_host, self.client_port))
 
+    def _cancel_tasks(self):
+        """
+        nobody gets the answers any more, the queued requests never start,
+        running handlers are cancelled at once or after the grace period of their route
+        """
+        self._requests.clear()
+        loop = asyncio.get_event_loop()
+        for task, route in self._tasks.items():
+            if route is not None and route.grace:
+                loop.call_later(route.grace, task.cancel)
+            else:
+                task.cancel()
+
     def data_received(self, data):
-        self.buffer += data
-        buffer = copy.deepcopy(self.buffer)
-        msgid_pos = buffer.find(b'\r\n')
-        if msgid_pos == -1:
-            if len(self.buffer) < Config.ProtocolBufferSize:
-                return
-            self.close(r'protocol abuse, no msgid within buffer size')
-            return
-        try:
-            msgid = buffer[:msgid_pos].decode(r'utf-8')
-        except UnicodeDecodeError as e:
-            self.close(r'protocol abuse, msgid decode error, {}'.format(e))
-            return
+        self.read_tick = self._timer_wheel.current
+        parser = self.parser
+        if parser is None:
+            parser = self.parser = self._create_parser(data)
+        parser.feed(data)
+        self._drain_frames()
 
-        buffer = buffer[msgid_pos+2:]
-        header_pos = buffer.find(b'\r\n')
-        if header_pos == -1:
-            if len(self.buffer) < Config.ProtocolBufferSize:
+    def _drain_frames(self):
+        """
+        drain every complete frame, pipelined requests must not wait for more bytes,
+        while reading is paused the frames stay in the parser, resume_reading_for drains them again
+        """
+        self._drain_handle = None
+        parser = self.parser
+        while not self._read_pauses and not self.transport.is_closing():
+            try:
+                frame = parser.next_frame()
+            except ProtocolError as e:
+                self.close(r'protocol abuse, {}'.format(e))
                 return
-            self.close(r'protocol abuse, no header within buffer size')
+            if frame is None:
+                return
+            msgid, header, content_view = frame
+            codec = _codecs.get(header[r'content_type'])
+            if codec is None:
+                content_view.release()
+                self.close(r'protocol abuse, content type not supported')
+                return
+            route = _handlers.routes.get(msgid, None)
+            if route is None:
+                content_view.release()
+                self.close(r'msgid not found')
+                return
+            if r'accept_encoding' in header:
+                self.content_encoding = choose_content_encoding(header[r'accept_encoding'])
+            try:
+                if r'content_encoding' in header:
+                    # the route limit applies to the inflated content, not only to the compressed one
+                    limit = min(route.max_content_length, Config.ProtocolInflateLimit)
+                    inflated = decompress_content(header[r'content_encoding'], content_view, limit)
+                    content_view.release()
+                    content_view = memoryview(inflated)
+                content = codec.decode(content_view)
+            except ContentEncodingError as e:
+                self.close(r'protocol abuse, {}'.format(e))
+                return
+            except Exception as e:
+                self.close(r'protocol abuse, parse content error, {}'.format(e))
+                return
+            finally:
+                content_view.release()
+            # msgid, header, content
+            request = {
+                r'msgid': msgid,
+                r'request_id': header.get(r'request_id', None),
+                r'header': header,
+                r'content': content,
+                r'content_type': self._answer_content_type(codec),
+            }
+            self.enqueue_request(route, request)
+
+    def enqueue_request(self, route, request):
+        """
+        requests with a request_id run concurrently in their own task, the client matches the answers by request_id,
+        the others run one by one in arrival order
+
+        both count against ProtocolMaxInflight, once it is reached the frames stay in the parser,
+        so no task is created for a request over the cap
+        """
+        requests = self._requests
+        if request[r'request_id'] is None:
+            requests.append((route, request))
+        else:
+            loop = asyncio.get_event_loop()
+            task = loop.create_task(self._run_concurrent(route, request))
+            self._tasks[task] = None
+        if self._inflight() >= Config.ProtocolMaxInflight:
+            # stop reading until the handlers catch up
+            self.pause_reading_for(_PAUSE_INFLIGHT)
+        if requests and self._runner is None:
+            loop = asyncio.get_event_loop()
+            self._runner = loop.create_task(self._process_requests())
+            self._tasks[self._runner] = None
+
+    def _answer_content_type(self, codec):
+        """
+        content type write_object answers a request in, fixed when the frame is parsed:
+        the structured codec of the request, or the latest one the client spoke for the others
+        """
+        if codec is not None and codec.structured:
+            self.content_type = codec.content_type
+        return self.content_type
+
+    def _inflight(self):
+        """
+        queued requests and the tasks running the others
+        """
+        return len(self._requests) + len(self._tasks)
+
+    def _open_sink(self, msgid, header):
+        """
+        called by the parser once the head of a frame is parsed, before any content is buffered
+        """
+        route = _handlers.routes.get(msgid, None)
+        if route is None:
+            raise ProtocolError(r'msgid {} not found'.format(msgid))
+        request_id = header.get(r'request_id', None)
+        if request_id is not None and (type(request_id) is not int or not 0 <= request_id <= MAX_REQUEST_ID):
+            raise ProtocolError(r'header error, bad request_id {}'.format(request_id))
+        content_length = header[r'content_length']
+        if content_length > route.max_content_length:
+            raise ProtocolError(r'content length {} exceeds {} of msgid {}'.format(content_length, route.max_content_length, msgid))
+        if route.rate_limit is not None:
+            wait = route.rate_limit.take(self)
+            if wait:
+                policy = route.rate_limit.policy
+                if policy == RateLimitPolicy.Delay:
+                    # the frame stays in the parser, it is offered again once the wait is over
+                    self._delay_reading(wait)
+                    return HOLD_FRAME
+                elif policy == RateLimitPolicy.Disconnect:
+                    self.close(r'rate limit of msgid {} exceeded'.format(msgid))
+                    return _discard_sink
+                else:
+                    app_log.debug(r'connection {}:{} msgid {} dropped by rate limit'.format(self.client_host, self.client_port, msgid))
+                    return _discard_sink
+        if route.streaming:
+            if r'content_encoding' in header:
+                raise ProtocolError(r'content_encoding not supported by streaming msgid {}'.format(msgid))
+            sink = self._sink = BodyStream(self, content_length)
+            request = {
+                r'msgid': msgid,
+                r'request_id': header.get(r'request_id', None),
+                r'header': header,
+                r'content': sink,
+                r'content_type': self._answer_content_type(_codecs.get(header[r'content_type'])),
+            }
+            self.enqueue_request(route, request)
+            return sink
+        if (content_length >= Config.ProtocolSpoolThreshold and header[r'content_type'] == ContentType.Byte
+                and r'content_encoding' not in header):
+            request = {
+                r'msgid': msgid,
+                r'request_id': header.get(r'request_id', None),
+                r'header': header,
+                r'content': None,
+                r'content_type': self.content_type,
+            }
+            sink = self._sink = SpoolSink(self, route, request)
+            return sink
+        return None
+
+    def _delay_reading(self, delay):
+        """
+        the bucket is empty, stop reading and draining until it has a token again
+        """
+        if self._rate_limit_handle is not None:
+            self._rate_limit_handle.cancel()
+        self.pause_reading_for(_PAUSE_RATE_LIMIT)
+        loop = asyncio.get_event_loop()
+        self._rate_limit_handle = loop.call_later(delay, self._resume_rate_limit)
+
+    def _resume_rate_limit(self):
+        self._rate_limit_handle = None
+        self.resume_reading_for(_PAUSE_RATE_LIMIT)
+
+    def spool_done(self, sink):
+        if self._sink is sink:
+            self._sink = None
+
+    def _create_parser(self, data):
+        if is_binary_preface(data):
+            self.binary = True
+            return BinaryFrameParser(_handlers.route_names, self._open_sink)
+        return TextFrameParser(Config.ProtocolBufferSize, self._open_sink)
+
+    def pause_reading_for(self, reason):
+        if not self._read_pauses and not self.transport.is_closing():
+            self.transport.pause_reading()
+        self._read_pauses.add(reason)
+
+    def resume_reading_for(self, reason):
+        if reason not in self._read_pauses:
             return
-        b_header = buffer[:header_pos]
-        buffer = buffer[header_pos+2:]
+        self._read_pauses.remove(reason)
+        if not self._read_pauses and not self.transport.is_closing():
+            self.transport.resume_reading()
+            if self.parser is not None and self._drain_handle is None:
+                # the frames left in the parser when reading paused
+                loop = asyncio.get_event_loop()
+                self._drain_handle = loop.call_soon(self._drain_frames)
+
+    @asyncio.coroutine
+    def _process_requests(self):
+        """
+        run the requests of this connection one by one, in arrival order
+        different connections have their own runner, so they still run concurrently,
+        up to the concurrency of the RequestScheduler
+        """
+        runner = self._runner
+        requests = self._requests
         try:
-            s_header = b_header.decode(r'utf-8')
-            header = json.loads(s_header)
-        except Exception as e:
-            self.close(r'protocol abuse, parse header failed, {}'.format(e))
-            return
-        # header = {
-        #     r'content_type': r'json', fixed
-        #     r'content_length': 1024, fixed
-        #     r'_': 0,
-        # }
+            while requests:
+                route, request = requests.popleft()
+                if self._inflight() <= Config.ProtocolMaxInflight // 2:
+                    self.resume_reading_for(_PAUSE_INFLIGHT)
+                yield from self._run_request(runner, route, request)
+        finally:
+            self._tasks.pop(runner, None)
+            self._runner = None
+
+    @asyncio.coroutine
+    def _run_concurrent(self, route, request):
+        task = _current_task()
         try:
-            content_type = header[r'content_type']
-            content_length = header[r'content_length']
-        except KeyError as e:
-            self.close(r'protocol abuse, header error, {}'.format(e))
-            return
-        if len(buffer) < header[r'content_length']:
-            return
-        b_content = buffer[:content_length]
-        buffer = buffer[content_length+1:]
+            yield from self._run_request(task, route, request)
+        finally:
+            self._tasks.pop(task, None)
+            if self._inflight() <= Config.ProtocolMaxInflight // 2:
+                self.resume_reading_for(_PAUSE_INFLIGHT)
+
+    @asyncio.coroutine
+    def _run_request(self, task, route, request):
+        """
+        run one request within a scheduler slot, task is the task running this coroutine
+        the handler is cancelled once it runs longer than the timeout of its route
+        """
+        yield from _scheduler.acquire(route.priority)
+        self._tasks[task] = route
+        timer = None
+        if route.timeout:
+            timer = self._timer_wheel.arm(route.timeout, task.cancel)
         try:
-            if content_type == ContentType.Json:
-                s_content = b_content.decode(r'utf-8')
-                content = json.loads(s_content)
-            elif content_type == ContentType.Byte:
-                content = b_content
-            elif content_type == ContentType.String:
-                content = b_content.decode(r'utf-8')
-            else:
-                self.close(r'protocol abuse, content type not supported')
-                return
+            yield from route.handle(self, request)
+        except asyncio.CancelledError:
+            if timer is None or timer.active:
+                raise
+            # the timer fired
+            app_log.warning(r'handle {} timed out after {} seconds'.format(request[r'msgid'], route.timeout))
         except Exception as e:
-            self.close(r'protocol abuse, parse content error, {}'.format(e))
-            return
-        self.buffer = buffer
-        # msgid, header, content
-        handler_class = HandlerFactory()(msgid)
-        if handler_class is None:
-            self.close(r'msgid not found')
-            return
-        request = {
-            r'msgid': msgid,
-            r'header': header,
-            r'content': content,
-        }
-        coro = handler_class().handle(self, request)
-        loop = asyncio.get_event_loop()
-        loop.create_task(coro)
+            app_log.exception(r'handle {} error, {}'.format(request[r'msgid'], e))
+        finally:
+            if timer is not None:
+                timer.cancel()
+            self._tasks[task] = None
+            if task in self._client_waits:
+                self._client_waits.discard(task)
+            else:
+                _scheduler.release()
+            if route.streaming:
+                request[r'content'].discard()
 
     def close(self, reason=None):
         if reason is not None:
             app_log.info(r'connection {}:{} closed because {}'.format(self.client_host, self.client_port, reason))
+        if self._outgoing and not self.transport.is_closing():
+            # the transport keeps flushing its buffer after close
+            self.transport.writelines(self._outgoing)
+        self._outgoing = []
+        self._outgoing_size = 0
         self.transport.close()
 
+    def pause_writing(self):
+        self.writing_paused = True
+
+    def resume_writing(self):
+        self.writing_paused = False
+        self._flush()
+        self._wakeup_drain_waiters()
+
+    def _wakeup_drain_waiters(self):
+        waiters, self._drain_waiters = self._drain_waiters, []
+        for waiter in waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+
+    @asyncio.coroutine
+    def drain(self):
+        """
+        wait until the client has read enough for writing to go on, handlers of bulk pushes yield from it
+        """
+        if not self.writing_paused or self.transport.is_closing():
+            return
+        waiter = asyncio.Future()
+        self._drain_waiters.append(waiter)
+        yield from self.wait_client(waiter)
+
+    @asyncio.coroutine
+    def wait_client(self, waiter):
+        """
+        wait for the client to send or read more, a handler gives its scheduler slot back meanwhile,
+        so stalled uploads and slow readers do not starve the handlers of other connections
+        """
+        task = _current_task()
+        route = self._tasks.get(task, None)
+        if route is None:
+            # not a handler of this connection, or one without a slot
+            yield from waiter
+            return
+        _scheduler.release()
+        self._client_waits.add(task)
+        yield from waiter
+        # cancelled before here, the task stays in _client_waits and _run_request does not release again
+        yield from _scheduler.acquire(route.priority)
+        self._client_waits.discard(task)
+
     def _write(self, msgid, header, b_data):
-        b_pack = b''
         try:
-            b_pack += msgid.encode('utf-8')
-            b_pack += b'\r\n'
-            b_pack += json.dumps(header).encode('utf-8')
-            b_pack += b'\r\n'
-            b_pack += b_data
+            b_head, b_data = pack_frame(msgid, header, b_data, self.binary, self.content_encoding)
         except Exception as e:
             app_log.exception(r'pack data error, {}'.format(e))
             return
-        self.transport.write(b_pack)
+        self._push(b_head, b_data)
 
-    def write_json(self, msgid, dict_data):
-        try:
-            s_data = json.dumps(dict_data)
-            b_data = s_data.encode(r'utf-8')
-        except Exception as e:
-            app_log.exception(r'write json error, {}'.format(e))
+    def _push(self, b_head, b_data):
+        if self.transport.is_closing():
             return
-        header = {
-            r'content_type': ContentType.Json,
-            r'content_length': len(b_data),
-        }
-        self._write(msgid, header, b_data)
+        # the frames of one loop iteration are flushed at its end, only frames held back by a slow client count
+        if self.writing_paused and self._outgoing_size >= Config.ProtocolOutgoingLimit:
+            if Config.ProtocolOverflowPolicy == OverflowPolicy.Disconnect:
+                self.close(r'outgoing buffer overflow')
+            else:
+                app_log.debug(r'connection {}:{} outgoing buffer full, frame dropped'.format(self.client_host, self.client_port))
+            return
+        outgoing = self._outgoing
+        if not outgoing and not self.writing_paused:
+            loop = asyncio.get_event_loop()
+            loop.call_soon(self._flush)
+        outgoing.append(b_head)
+        outgoing.append(b_data)
+        self._outgoing_size += len(b_head) + len(b_data)
+
+    def _flush(self):
+        """
+        hand every frame of this loop iteration to the transport in one call
+        """
+        outgoing = self._outgoing
+        if not outgoing or self.writing_paused:
+            # held back until resume_writing
+            return
+        self._outgoing = []
+        self._outgoing_size = 0
+        if self.transport.is_closing():
+            return
+        self.write_tick = self._timer_wheel.current
+        self.transport.writelines(outgoing)
+
+    def bind_account(self, account_id, account_info):
+        manager = ConnectionManager()
+        if self.account_id is not None:
+            manager.leave(self, GroupType.Account, self.account_id)
+        self.authenticated = True
+        self.account_id = account_id
+        self.account_info = account_info
+        if self.auth_timer is not None:
+            self.auth_timer.cancel()
+            self.auth_timer = None
+        manager.join(self, GroupType.Account, account_id)
 
-    def write_string(self, msgid, s_data):
+    def join_room(self, room_id):
+        ConnectionManager().join(self, GroupType.Room, room_id)
+
+    def leave_room(self, room_id):
+        ConnectionManager().leave(self, GroupType.Room, room_id)
+
+    def ping(self):
+        self.write_object(Config.HeartbeatMsgid, {})
+
+    def write_content(self, msgid, content_type, data, request_id=None):
+        codec = _codecs.get(content_type)
+        if codec is None:
+            app_log.error(r'write {} error, content type not supported'.format(content_type))
+            return
         try:
-            b_data = s_data.encode(r'utf-8')
+            b_data = codec.encode(data)
         except Exception as e:
-            app_log.exception(r'write string error, {}'.format(e))
+            app_log.exception(r'write {} error, {}'.format(content_type, e))
             return
         header = {
-            r'content_type': ContentType.String,
+            r'content_type': content_type,
             r'content_length': len(b_data),
         }
+        if request_id is not None:
+            # the answer of request[r'request_id']
+            header[r'request_id'] = request_id
         self._write(msgid, header, b_data)
 
-    def write_byte(self, msgid, b_data):
-        header = {
-            r'content_type': ContentType.Byte,
-            r'content_length': len(b_data),
-        }
-        self._write(msgid, header, b_data)
+    def write_object(self, msgid, data, request_id=None, request=None):
+        """
+        the answer of request is encoded with the structured codec the request came in, see request[r'content_type'],
+        the other frames with the one of the client's latest request, json by default
+        """
+        if request is None:
+            self.write_content(msgid, self.content_type, data, request_id)
+            return
+        if request_id is None:
+            request_id = request[r'request_id']
+        self.write_content(msgid, request[r'content_type'], data, request_id)
+
+    def write_json(self, msgid, dict_data, request_id=None):
+        self.write_content(msgid, ContentType.Json, dict_data, request_id)
+
+    def write_msgpack(self, msgid, data, request_id=None):
+        self.write_content(msgid, ContentType.Msgpack, data, request_id)
+
+    def write_string(self, msgid, s_data, request_id=None):
+        self.write_content(msgid, ContentType.String, s_data, request_id)
+
+    def write_byte(self, msgid, b_data, request_id=None):
+        self.write_content(msgid, ContentType.Byte, b_data, request_id)
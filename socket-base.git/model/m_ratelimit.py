@@ -0,0 +1,129 @@
+
+import asyncio
+
+from util.util import Const
+
+
+RateLimitPolicy = Const()
+# skip the frame, its content is not even buffered
+RateLimitPolicy.Drop = r'drop'
+# keep the frame and every frame after it unread until the bucket has a token again
+RateLimitPolicy.Delay = r'delay'
+# close the connection
+RateLimitPolicy.Disconnect = r'disconnect'
+
+
+class TokenBucket(object):
+
+    __slots__ = (r'rate', r'burst', r'tokens', r'stamp')
+
+    def __init__(self, rate, burst, now):
+
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.stamp = now
+
+    def wait(self, now):
+        """
+        returns 0 if one token is available, or the seconds until it is, takes nothing
+        """
+
+        self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+
+        self.stamp = now
+
+        if self.tokens >= 1:
+            return 0
+
+        return (1 - self.tokens) / self.rate
+
+    def take(self, now):
+        """
+        take one token, returns 0 or the seconds until one token is available again
+        """
+
+        wait = self.wait(now)
+
+        if not wait:
+            self.tokens -= 1
+
+        return wait
+
+    def full(self, now):
+
+        return self.tokens + (now - self.stamp) * self.rate >= self.burst
+
+
+class RateLimit(object):
+    """
+    token buckets of one msgid, compiled from the r'rate_limit' route option
+
+        r'rate_limit': {
+            r'connection': (rate, burst),   # frames per second of each connection
+            r'account': (rate, burst),      # frames per second of all connections of an account
+            r'policy': RateLimitPolicy.Drop,
+        }
+
+    connection buckets live on the connection and go with it,
+    account buckets stay here and are pruned once they are full again
+    """
+
+    def __init__(self, msgid, options):
+
+        self.msgid = msgid
+        self.policy = options.get(r'policy', RateLimitPolicy.Drop)
+
+        if self.policy not in (RateLimitPolicy.Drop, RateLimitPolicy.Delay, RateLimitPolicy.Disconnect):
+            raise ValueError(r'rate limit policy {} of msgid {} not supported'.format(self.policy, msgid))
+
+        self._connection = options.get(r'connection', None)
+        self._account = options.get(r'account', None)
+
+        # account_id => TokenBucket
+        self._accounts = {}
+        self._prune_size = 1024
+
+    def take(self, conn):
+        """
+        returns 0 if the frame may pass, or the seconds until it would
+
+        a token is taken from the buckets only when all of them allow the frame,
+        so a frame offered again after the wait is not charged for the refusals
+        """
+
+        now = asyncio.get_event_loop().time()
+
+        buckets = []
+
+        if self._connection is not None:
+            bucket = conn.rate_buckets.get(self.msgid, None)
+            if bucket is None:
+                bucket = conn.rate_buckets[self.msgid] = TokenBucket(*self._connection, now=now)
+            buckets.append(bucket)
+
+        if self._account is not None and conn.account_id is not None:
+            bucket = self._accounts.get(conn.account_id, None)
+            if bucket is None:
+                bucket = self._accounts[conn.account_id] = self._new_account_bucket(now)
+            buckets.append(bucket)
+
+        wait = max([bucket.wait(now) for bucket in buckets], default=0)
+
+        if not wait:
+            for bucket in buckets:
+                bucket.tokens -= 1
+
+        return wait
+
+    def _new_account_bucket(self, now):
+
+        accounts = self._accounts
+
+        if len(accounts) >= self._prune_size:
+            # a full bucket is the same as a new one
+            for account_id in [key for key, bucket in accounts.items() if bucket.full(now)]:
+                del accounts[account_id]
+            self._prune_size = max(1024, len(accounts) * 2)
+
+        return TokenBucket(*self._account, now=now)
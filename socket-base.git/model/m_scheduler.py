@@ -0,0 +1,104 @@
+
+import asyncio
+from collections import deque
+
+from util.util import Singleton, Const
+from config import Config
+
+
+# priority lanes of the scheduler, a lower lane always goes first
+Priority = Const()
+Priority.High = 0
+Priority.Normal = 1
+Priority.Low = 2
+
+_LANES = 3
+
+
+class RequestScheduler(Singleton):
+    """
+    global concurrency cap of the handlers, between the connection runners and BaseHandler.handle
+
+    a runner takes a slot before each request and gives it back afterwards,
+    a handler waiting on its client gives the slot back meanwhile, see ServerProtocol.wait_client,
+    while every slot is taken the runners wait in the lane of their route, FIFO within a lane,
+    a freed slot goes straight to the first waiter of the highest lane
+
+    the requests of one connection still run one by one, in arrival order
+    """
+
+    def __init__(self):
+
+        self.concurrency = Config.SchedulerConcurrency
+        self.running = 0
+        self.waiting = 0
+
+        self._lanes = [deque() for _ in range(_LANES)]
+
+        # stats since the last report
+        self.scheduled = 0
+        self.delayed = 0
+        self.max_waiting = 0
+
+    @asyncio.coroutine
+    def acquire(self, lane=Priority.Normal):
+
+        self.scheduled += 1
+
+        if self.running < self.concurrency and not self.waiting:
+            self.running += 1
+            return
+
+        waiter = asyncio.Future()
+
+        self._lanes[lane].append(waiter)
+
+        self.waiting += 1
+        self.delayed += 1
+        if self.waiting > self.max_waiting:
+            self.max_waiting = self.waiting
+
+        try:
+            yield from waiter
+        except asyncio.CancelledError:
+            if waiter.cancelled():
+                # release may have popped the cancelled waiter already
+                waiters = self._lanes[lane]
+                if waiter in waiters:
+                    waiters.remove(waiter)
+                    self.waiting -= 1
+            else:
+                # the slot was handed over before the cancel arrived
+                self.release()
+            raise
+
+    def release(self):
+
+        for lane in self._lanes:
+            while lane:
+                waiter = lane.popleft()
+                self.waiting -= 1
+                # a waiter is cancelled at once with its task, before the task wakes up to remove it
+                if not waiter.done():
+                    # the slot goes over without running dropping
+                    waiter.set_result(None)
+                    return
+
+        self.running -= 1
+
+    def stats(self, reset=False):
+
+        result = {
+            r'concurrency': self.concurrency,
+            r'running': self.running,
+            r'waiting': [len(lane) for lane in self._lanes],
+            r'max_waiting': self.max_waiting,
+            r'scheduled': self.scheduled,
+            r'delayed': self.delayed,
+        }
+
+        if reset:
+            self.scheduled = self.delayed = 0
+            self.max_waiting = self.waiting
+
+        return result
@@ -1,9 +1,40 @@
 
-from controller import account
+from controller import account, system
+from model.m_middleware import require_auth
+from model.m_scheduler import Priority
 
 
+# msgid => handler_class, or msgid => (handler_class, options)
 routing_table = {
 
-    r'auth': account.AuthAccount,
+    r'auth': (account.AuthAccount, {
+        r'anonymous': True,
+        r'priority': Priority.High,
+    }),
 
-}
\ No newline at end of file
+    r'ping': (system.Heartbeat, {
+        r'anonymous': True,
+        r'priority': Priority.High,
+        r'rate_limit': {r'connection': (1, 10), r'policy': r'drop'},
+    }),
+
+}
+
+
+# middleware of every route, composed into each route when the routing table is loaded
+middleware = [
+
+    require_auth,
+
+]
+
+
+# msgid => route id, used by the binary frame protocol instead of the msgid string
+# ids must stay stable once clients ship, 0 is reserved for inline msgid
+route_ids = {
+
+    r'auth': 1,
+
+    r'ping': 2,
+
+}
@@ -1,11 +1,30 @@
 
 import asyncio
 
-from util.util import Singleton, RepeatTask
+from util.util import Singleton, RepeatTask, app_log
+from config import Config
+from model import RedisPool
+from model.m_scheduler import RequestScheduler
+
+
+def report_scheduler():
+
+    app_log.info(r'scheduler {}'.format(RequestScheduler().stats(reset=True)))
+
+
+def report_redis_pool():
+
+    conn_status = RedisPool().get_conn_status()
+
+    if conn_status[r'leaked_num']:
+        app_log.warning(r'redis pool {} leases held over {} seconds, {}'.format(
+            conn_status[r'leaked_num'], Config.RedisLeaseTimeout, conn_status))
 
 
 _task_settings = [
     # (30, report_status),
+    (Config.SchedulerReportInterval, report_scheduler),
+    (Config.RedisLeaseTimeout, report_redis_pool),
 ]
 
 
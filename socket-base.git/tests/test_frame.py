@@ -0,0 +1,183 @@
+
+import json
+import unittest
+
+from model.m_frame import ProtocolError, TextFrameParser, BinaryFrameParser
+from model.m_frame import BINARY_PREFACE, HOLD_FRAME, pack_binary_head
+
+
+def _text_frame(msgid, content, **header):
+
+    header.setdefault(r'content_type', r'byte')
+    header[r'content_length'] = len(content)
+
+    return (msgid + '\r\n' + json.dumps(header) + '\r\n').encode(r'utf-8') + content
+
+
+_ROUTE_IDS = {r'a': 1, r'b': 2}
+_ROUTE_NAMES = {1: r'a', 2: r'b'}
+
+
+def _binary_frame(msgid, content, **header):
+
+    header.setdefault(r'content_type', r'byte')
+    header[r'content_length'] = len(content)
+
+    return bytes(pack_binary_head(msgid, header, _ROUTE_IDS)) + content
+
+
+def _drain(parser):
+
+    frames = []
+
+    while True:
+        frame = parser.next_frame()
+        if frame is None:
+            return frames
+        msgid, header, content_view = frame
+        frames.append((msgid, header, content_view.tobytes()))
+        content_view.release()
+
+
+class TextFrameParserTest(unittest.TestCase):
+
+    def test_pipelined_frames(self):
+
+        parser = TextFrameParser(2048)
+
+        parser.feed(_text_frame(r'a', b'one') + _text_frame(r'b', b'') + _text_frame(r'c', b'three'))
+
+        frames = _drain(parser)
+
+        self.assertEqual([(msgid, content) for msgid, _, content in frames], [(r'a', b'one'), (r'b', b''), (r'c', b'three')])
+        self.assertEqual(frames[0][1], {r'content_type': r'byte', r'content_length': 3})
+        self.assertEqual(parser.buffered_size(), 0)
+
+    def test_every_split(self):
+
+        data = _text_frame(r'msg', b'\r\n\r\ncontent', request_id=7) + _text_frame(r'next', b'x')
+
+        # a split inside the delimiter or the content must not change the frames
+        for pos in range(len(data) + 1):
+
+            parser = TextFrameParser(2048)
+
+            parser.feed(data[:pos])
+            frames = _drain(parser)
+            parser.feed(data[pos:])
+            frames.extend(_drain(parser))
+
+            self.assertEqual(
+                [(msgid, content) for msgid, _, content in frames], [(r'msg', b'\r\n\r\ncontent'), (r'next', b'x')], pos
+            )
+            self.assertEqual(frames[0][1][r'request_id'], 7)
+
+    def test_byte_by_byte(self):
+
+        data = _text_frame(r'msg', b'content') * 3
+
+        parser = TextFrameParser(2048)
+        frames = []
+
+        for pos in range(len(data)):
+            parser.feed(data[pos:pos + 1])
+            frames.extend(_drain(parser))
+
+        self.assertEqual([content for _, _, content in frames], [b'content'] * 3)
+
+    def test_hold_frame(self):
+
+        offers = []
+
+        def open_sink(msgid, header):
+            offers.append(msgid)
+            return HOLD_FRAME if len(offers) == 1 else None
+
+        parser = TextFrameParser(2048, open_sink)
+
+        parser.feed(_text_frame(r'a', b'one') + _text_frame(r'b', b'two'))
+
+        # the held frame and the frames after it stay in the parser
+        self.assertIsNone(parser.next_frame())
+        self.assertEqual(offers, [r'a'])
+
+        self.assertEqual([content for _, _, content in _drain(parser)], [b'one', b'two'])
+        self.assertEqual(offers, [r'a', r'a', r'b'])
+
+    def test_line_limit(self):
+
+        parser = TextFrameParser(16)
+
+        parser.feed(b'x' * 16)
+
+        with self.assertRaises(ProtocolError):
+            parser.next_frame()
+
+    def test_bad_header(self):
+
+        for line in (b'not json', b'[]', b'{"content_length": 1}', b'{"content_type": 1, "content_length": 1}',
+                     b'{"content_type": "byte", "content_length": -1}'):
+
+            parser = TextFrameParser(2048)
+            parser.feed(b'msg\r\n' + line + b'\r\n')
+
+            with self.assertRaises(ProtocolError, msg=line):
+                parser.next_frame()
+
+
+class BinaryFrameParserTest(unittest.TestCase):
+
+    def test_frames(self):
+
+        parser = BinaryFrameParser(_ROUTE_NAMES)
+
+        parser.feed(
+            BINARY_PREFACE + _binary_frame(r'a', b'one') + _binary_frame(r'b', b'two', request_id=9)
+            + _binary_frame(r'inline', b'three', content_type=r'string')
+        )
+
+        self.assertEqual(_drain(parser), [
+            (r'a', {r'content_type': r'byte', r'content_length': 3}, b'one'),
+            (r'b', {r'content_type': r'byte', r'content_length': 3, r'request_id': 9}, b'two'),
+            (r'inline', {r'content_type': r'string', r'content_length': 5}, b'three'),
+        ])
+
+    def test_every_split(self):
+
+        data = (
+            BINARY_PREFACE + _binary_frame(r'a', b'one', request_id=1)
+            + _binary_frame(r'inline', b'two', request_id=2, content_encoding=r'deflate')
+        )
+
+        for pos in range(len(data) + 1):
+
+            parser = BinaryFrameParser(_ROUTE_NAMES)
+
+            parser.feed(data[:pos])
+            frames = _drain(parser)
+            parser.feed(data[pos:])
+            frames.extend(_drain(parser))
+
+            self.assertEqual([(msgid, content) for msgid, _, content in frames], [(r'a', b'one'), (r'inline', b'two')], pos)
+            self.assertEqual(frames[1][1][r'request_id'], 2)
+            self.assertEqual(frames[1][1][r'content_encoding'], r'deflate')
+
+    def test_bad_preface(self):
+
+        parser = BinaryFrameParser(_ROUTE_NAMES)
+        parser.feed(b'\xffXX\x01')
+
+        with self.assertRaises(ProtocolError):
+            parser.next_frame()
+
+    def test_unknown_route_id(self):
+
+        parser = BinaryFrameParser({})
+        parser.feed(BINARY_PREFACE + _binary_frame(r'a', b''))
+
+        with self.assertRaises(ProtocolError):
+            parser.next_frame()
+
+
+if __name__ == r'__main__':
+    unittest.main()
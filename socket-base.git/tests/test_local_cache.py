@@ -0,0 +1,68 @@
+
+import unittest
+
+from util.redis import LocalCache, _MISSING
+
+
+class LocalCacheTest(unittest.TestCase):
+
+    def test_lru_eviction(self):
+
+        cache = LocalCache(2, 60)
+
+        for key in (r'a', r'b', r'c'):
+            cache.set(key, key, cache.version)
+
+        self.assertEqual(cache.get_status()[r'evictions'], 1)
+        self.assertIs(cache.get(r'a'), _MISSING)
+        self.assertEqual(cache.get(r'c'), r'c')
+
+    def test_fetch_across_own_invalidation_is_not_cached(self):
+
+        cache = LocalCache(8, 60)
+
+        version = cache.version
+        cache.invalidate([r'a'])
+        cache.set(r'a', 1, version)
+
+        self.assertIs(cache.get(r'a'), _MISSING)
+
+    def test_fetch_across_other_invalidation_is_cached(self):
+
+        cache = LocalCache(8, 60)
+
+        version = cache.version
+        cache.invalidate([r'b'])
+        cache.set(r'a', 1, version)
+
+        self.assertEqual(cache.get(r'a'), 1)
+
+    def test_forgotten_invalidation_blocks_older_fetches(self):
+
+        cache = LocalCache(8, 60)
+        cache._invalidated_size = 2
+
+        version = cache.version
+        for key in (r'a', r'b', r'c'):
+            cache.invalidate([key])
+        cache.set(r'a', 1, version)
+        cache.set(r'd', 1, cache.version)
+
+        self.assertIs(cache.get(r'a'), _MISSING)
+        self.assertEqual(cache.get(r'd'), 1)
+
+    def test_clear(self):
+
+        cache = LocalCache(8, 60)
+
+        version = cache.version
+        cache.set(r'a', 1, version)
+        cache.clear()
+        cache.set(r'b', 1, version)
+
+        self.assertIs(cache.get(r'a'), _MISSING)
+        self.assertIs(cache.get(r'b'), _MISSING)
+
+
+if __name__ == r'__main__':
+    unittest.main()
@@ -0,0 +1,254 @@
+
+import json
+import asyncio
+import unittest
+
+from config import Config
+from model.m_frame import TextFrameParser
+from model.m_handler import HandlerFactory, BaseHandler
+from model.m_protocol import ServerProtocol
+from model.m_ratelimit import RateLimitPolicy
+
+
+def _text_frame(msgid, content, **header):
+
+    b_data = json.dumps(content).encode(r'utf-8')
+
+    header[r'content_type'] = r'json'
+    header[r'content_length'] = len(b_data)
+
+    return (msgid + '\r\n' + json.dumps(header) + '\r\n').encode(r'utf-8') + b_data
+
+
+class _Transport(object):
+
+    def __init__(self):
+
+        self.written = bytearray()
+        self.reading = True
+        self.closing = False
+
+    def get_extra_info(self, name):
+
+        return (r'127.0.0.1', 4900)
+
+    def set_write_buffer_limits(self, high, low):
+
+        pass
+
+    def pause_reading(self):
+
+        self.reading = False
+
+    def resume_reading(self):
+
+        self.reading = True
+
+    def is_closing(self):
+
+        return self.closing
+
+    def writelines(self, data):
+
+        for chunk in data:
+            self.written += chunk
+
+    def close(self):
+
+        self.closing = True
+
+    def frames(self):
+
+        parser = TextFrameParser(Config.ProtocolBufferSize)
+        parser.feed(self.written)
+
+        result = []
+
+        while True:
+            frame = parser.next_frame()
+            if frame is None:
+                return result
+            msgid, header, content_view = frame
+            result.append((msgid, header, content_view.tobytes()))
+            content_view.release()
+
+
+class _Gate(object):
+    """
+    handlers of the routes below wait on it, so the test decides when they finish
+    """
+
+    event = None
+    peak = 0
+
+
+class Echo(BaseHandler):
+
+    @asyncio.coroutine
+    def run(self, conn, request):
+
+        _Gate.peak = max(_Gate.peak, conn._inflight())
+
+        yield from _Gate.event.wait()
+
+        conn.write_object(request[r'msgid'], request[r'content'], request=request)
+
+
+class Bulk(BaseHandler):
+
+    @asyncio.coroutine
+    def run(self, conn, request):
+
+        for _ in range(request[r'content'][r'count']):
+            conn.write_byte(request[r'msgid'], b'x' * request[r'content'][r'size'])
+
+
+class Stamp(BaseHandler):
+
+    @asyncio.coroutine
+    def run(self, conn, request):
+
+        conn.write_object(request[r'msgid'], asyncio.get_event_loop().time(), request=request)
+
+
+class ProtocolTestCase(unittest.TestCase):
+
+    routing_table = {
+        r'echo': Echo,
+        r'bulk': Bulk,
+        r'stamp': Stamp,
+        r'limited': (Stamp, {r'rate_limit': {r'connection': (20, 1), r'policy': RateLimitPolicy.Delay}}),
+        r'dropped': (Stamp, {r'rate_limit': {r'connection': (0.001, 1)}}),
+    }
+
+    def setUp(self):
+
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+        HandlerFactory().load_settings(self.routing_table)
+
+        _Gate.event = asyncio.Event()
+        _Gate.peak = 0
+
+        self.transport = _Transport()
+        self.protocol = ServerProtocol()
+        self.protocol.connection_made(self.transport)
+
+    def tearDown(self):
+
+        self.protocol.connection_lost(None)
+        self.loop.run_until_complete(asyncio.sleep(0))
+        self.loop.close()
+        asyncio.set_event_loop(None)
+
+    def run_until(self, predicate, timeout=2):
+
+        @asyncio.coroutine
+        def wait():
+            while not predicate():
+                yield from asyncio.sleep(0.001)
+
+        self.loop.run_until_complete(asyncio.wait_for(wait(), timeout))
+
+
+class FlowControlTest(ProtocolTestCase):
+
+    def test_frames_stay_in_parser_while_reading_is_paused(self):
+
+        count = 1000
+
+        self.protocol.data_received(b''.join(_text_frame(r'echo', {r'i': i}) for i in range(count)))
+
+        # reading paused at the cap, the other frames were not even parsed
+        self.assertFalse(self.transport.reading)
+        self.assertEqual(self.protocol._inflight(), Config.ProtocolMaxInflight)
+        self.assertGreater(self.protocol.parser.buffered_size(), 0)
+
+        _Gate.event.set()
+
+        self.run_until(lambda: len(self.transport.frames()) == count)
+
+        self.assertEqual([json.loads(content) for _, _, content in self.transport.frames()], [{r'i': i} for i in range(count)])
+        self.assertLessEqual(_Gate.peak, Config.ProtocolMaxInflight)
+        self.assertTrue(self.transport.reading)
+        self.assertEqual(self.protocol.parser.buffered_size(), 0)
+
+    def test_frames_of_one_iteration_over_the_outgoing_limit(self):
+
+        size = Config.ProtocolOutgoingLimit // 2 + 1
+
+        self.protocol.data_received(_text_frame(r'bulk', {r'count': 3, r'size': size}))
+
+        self.run_until(lambda: len(self.transport.frames()) == 3)
+
+        self.assertFalse(self.transport.closing)
+
+    def test_frames_held_back_while_writing_is_paused(self):
+
+        size = Config.ProtocolOutgoingLimit // 2 + 1
+
+        self.protocol.pause_writing()
+        self.protocol.data_received(_text_frame(r'bulk', {r'count': 3, r'size': size}))
+
+        self.run_until(lambda: not self.protocol._tasks)
+
+        self.assertEqual(self.transport.written, b'')
+
+        self.protocol.resume_writing()
+
+        # the frame over the limit is dropped by the default policy
+        self.assertEqual(len(self.transport.frames()), 2)
+
+
+class ConcurrentRequestTest(ProtocolTestCase):
+
+    def test_tasks_are_bounded_by_the_inflight_cap(self):
+
+        count = 1000
+
+        self.protocol.data_received(b''.join(_text_frame(r'echo', {r'i': i}, request_id=i) for i in range(count)))
+
+        # no task is created for a frame over the cap
+        self.assertEqual(len(self.protocol._tasks), Config.ProtocolMaxInflight)
+        self.assertFalse(self.transport.reading)
+
+        _Gate.event.set()
+
+        self.run_until(lambda: len(self.transport.frames()) == count)
+
+        answers = {header[r'request_id']: json.loads(content) for _, header, content in self.transport.frames()}
+
+        self.assertEqual(answers, {i: {r'i': i} for i in range(count)})
+        self.assertLessEqual(_Gate.peak, Config.ProtocolMaxInflight)
+        self.assertFalse(self.protocol._tasks)
+
+
+class RateLimitTest(ProtocolTestCase):
+
+    def test_delay_holds_later_frames(self):
+
+        self.protocol.data_received(b''.join(_text_frame(r'limited', {}) for _ in range(3)) + _text_frame(r'stamp', {}))
+
+        self.run_until(lambda: len(self.transport.frames()) == 4)
+
+        frames = self.transport.frames()
+        stamps = [json.loads(content) for _, _, content in frames]
+
+        # one frame per 50ms, the frame of the other route waits behind the held one
+        self.assertEqual([msgid for msgid, _, _ in frames], [r'limited', r'limited', r'limited', r'stamp'])
+        self.assertGreaterEqual(stamps[1] - stamps[0], 0.04)
+        self.assertGreaterEqual(stamps[2] - stamps[1], 0.04)
+        self.assertTrue(self.transport.reading)
+
+    def test_drop(self):
+
+        self.protocol.data_received(b''.join(_text_frame(r'dropped', {}) for _ in range(3)) + _text_frame(r'stamp', {}))
+
+        self.run_until(lambda: len(self.transport.frames()) == 2)
+
+        self.assertEqual([msgid for msgid, _, _ in self.transport.frames()], [r'dropped', r'stamp'])
+
+
+if __name__ == r'__main__':
+    unittest.main()
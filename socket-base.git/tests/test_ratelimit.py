@@ -0,0 +1,107 @@
+
+import asyncio
+import unittest
+
+from model.m_ratelimit import TokenBucket, RateLimit, RateLimitPolicy
+
+
+class _Connection(object):
+
+    def __init__(self, account_id=None):
+
+        self.account_id = account_id
+        self.rate_buckets = {}
+
+
+class TokenBucketTest(unittest.TestCase):
+
+    def test_burst_then_rate(self):
+
+        bucket = TokenBucket(2, 3, now=0)
+
+        self.assertEqual([bucket.take(0) for _ in range(3)], [0, 0, 0])
+        self.assertAlmostEqual(bucket.take(0), 0.5)
+        self.assertEqual(bucket.take(0.5), 0)
+        self.assertAlmostEqual(bucket.take(0.5), 0.5)
+
+    def test_refill_is_capped_at_burst(self):
+
+        bucket = TokenBucket(10, 2, now=0)
+
+        self.assertTrue(bucket.full(100))
+        self.assertEqual([bucket.take(100) for _ in range(2)], [0, 0])
+        self.assertGreater(bucket.take(100), 0)
+        self.assertFalse(bucket.full(100))
+
+    def test_wait_takes_nothing(self):
+
+        bucket = TokenBucket(1, 1, now=0)
+
+        self.assertEqual(bucket.wait(0), 0)
+        self.assertEqual(bucket.wait(0), 0)
+        self.assertEqual(bucket.take(0), 0)
+        self.assertAlmostEqual(bucket.wait(0), 1)
+
+
+class RateLimitTest(unittest.TestCase):
+
+    def setUp(self):
+
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+    def tearDown(self):
+
+        self.loop.close()
+        asyncio.set_event_loop(None)
+
+    def test_unknown_policy(self):
+
+        with self.assertRaises(ValueError):
+            RateLimit(r'msg', {r'policy': r'queue'})
+
+    def test_connection_bucket(self):
+
+        rate_limit = RateLimit(r'msg', {r'connection': (0.001, 2)})
+
+        conn = _Connection()
+
+        self.assertEqual(rate_limit.take(conn), 0)
+        self.assertEqual(rate_limit.take(conn), 0)
+        self.assertGreater(rate_limit.take(conn), 0)
+
+        # another connection has its own bucket
+        self.assertEqual(rate_limit.take(_Connection()), 0)
+
+    def test_account_bucket_is_shared(self):
+
+        rate_limit = RateLimit(r'msg', {r'account': (0.001, 2)})
+
+        first, second = _Connection(r'a'), _Connection(r'a')
+
+        self.assertEqual(rate_limit.take(first), 0)
+        self.assertEqual(rate_limit.take(second), 0)
+        self.assertGreater(rate_limit.take(first), 0)
+
+        # not authenticated, no account bucket applies
+        self.assertEqual(rate_limit.take(_Connection()), 0)
+
+    def test_refused_frame_is_not_charged(self):
+
+        rate_limit = RateLimit(
+            r'msg', {r'connection': (0.001, 5), r'account': (0.001, 1), r'policy': RateLimitPolicy.Delay}
+        )
+
+        conn = _Connection(r'a')
+
+        self.assertEqual(rate_limit.take(conn), 0)
+
+        # a held frame is offered again after every wait while the account bucket refuses it
+        for _ in range(10):
+            self.assertGreater(rate_limit.take(conn), 0)
+
+        self.assertGreaterEqual(conn.rate_buckets[r'msg'].tokens, 4)
+
+
+if __name__ == r'__main__':
+    unittest.main()
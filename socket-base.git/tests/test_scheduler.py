@@ -0,0 +1,115 @@
+
+import asyncio
+import unittest
+
+from model.m_scheduler import RequestScheduler, Priority
+
+
+def _new_scheduler(concurrency):
+
+    # a fresh instance, not the process wide singleton
+    scheduler = RequestScheduler.__new__(RequestScheduler)
+    scheduler.__init__()
+    scheduler.concurrency = concurrency
+
+    return scheduler
+
+
+class RequestSchedulerTest(unittest.TestCase):
+
+    def setUp(self):
+
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+    def tearDown(self):
+
+        self.loop.close()
+        asyncio.set_event_loop(None)
+
+    def test_priority_lanes(self):
+
+        scheduler = _new_scheduler(1)
+        order = []
+
+        @asyncio.coroutine
+        def run(name, lane):
+            yield from scheduler.acquire(lane)
+            order.append(name)
+            yield from asyncio.sleep(0)
+            scheduler.release()
+
+        @asyncio.coroutine
+        def main():
+            yield from scheduler.acquire()
+            tasks = [
+                self.loop.create_task(run(r'low', Priority.Low)),
+                self.loop.create_task(run(r'normal', Priority.Normal)),
+                self.loop.create_task(run(r'high', Priority.High)),
+            ]
+            yield from asyncio.sleep(0)
+            scheduler.release()
+            yield from asyncio.gather(*tasks)
+
+        self.loop.run_until_complete(main())
+
+        self.assertEqual(order, [r'high', r'normal', r'low'])
+        self.assertEqual(scheduler.running, 0)
+        self.assertEqual(scheduler.waiting, 0)
+
+    def test_release_skips_cancelled_waiters(self):
+
+        scheduler = _new_scheduler(1)
+        done = []
+
+        @asyncio.coroutine
+        def run(name):
+            yield from scheduler.acquire()
+            try:
+                done.append(name)
+            finally:
+                scheduler.release()
+
+        @asyncio.coroutine
+        def main():
+            yield from scheduler.acquire()
+            waiting = [self.loop.create_task(run(index)) for index in range(2)]
+            yield from asyncio.sleep(0)
+            # a lost connection cancels its waiting tasks in one go, the slot is released before they wake up
+            for task in waiting:
+                task.cancel()
+            scheduler.release()
+            results = yield from asyncio.gather(*waiting, return_exceptions=True)
+            for result in results:
+                self.assertIsInstance(result, asyncio.CancelledError)
+            self.assertEqual(scheduler.running, 0)
+            self.assertEqual(scheduler.waiting, 0)
+            # the next request still gets a slot
+            yield from asyncio.wait_for(run(r'next'), 1)
+
+        self.loop.run_until_complete(main())
+
+        self.assertEqual(done, [r'next'])
+        self.assertEqual(scheduler.stats()[r'waiting'], [0, 0, 0])
+
+    def test_cancel_after_handover(self):
+
+        scheduler = _new_scheduler(1)
+
+        @asyncio.coroutine
+        def main():
+            yield from scheduler.acquire()
+            task = self.loop.create_task(scheduler.acquire())
+            yield from asyncio.sleep(0)
+            # the slot goes to the waiter, then its task is cancelled before it resumes
+            scheduler.release()
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                yield from task
+            self.assertEqual(scheduler.running, 0)
+
+        self.loop.run_until_complete(main())
+
+
+if __name__ == r'__main__':
+    unittest.main()
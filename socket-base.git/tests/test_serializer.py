@@ -0,0 +1,89 @@
+
+import zlib
+import pickle
+import unittest
+
+from util.serializer import SerializerRegistry, SerializeError, BaseSerializer, dumps_value, loads_value
+
+
+_registry = SerializerRegistry()
+
+
+class SerializerTest(unittest.TestCase):
+
+    def test_tags(self):
+
+        for name, code, val in ((r'raw', 1, b'value'), (r'json', 2, {r'a': [1, 2]}), (r'pickle', 4, {r'a': (1, 2)})):
+
+            b_val = dumps_value(_registry.get(name), val, 0)
+
+            self.assertEqual(b_val[0], code, name)
+            self.assertEqual(loads_value(b_val), val, name)
+
+    def test_msgpack(self):
+
+        serializer = _registry.get(r'msgpack')
+
+        if serializer is None:
+            self.skipTest(r'msgpack is not installed')
+
+        b_val = dumps_value(serializer, {r'a': [1, b'2']}, 0)
+
+        self.assertEqual(b_val[0], 3)
+        self.assertEqual(loads_value(b_val), {r'a': [1, b'2']})
+
+    def test_compress(self):
+
+        serializer = _registry.get(r'json')
+
+        b_val = dumps_value(serializer, r'x' * 1000, 100)
+
+        self.assertEqual(b_val[0], 0x82)
+        self.assertLess(len(b_val), 100)
+        self.assertEqual(loads_value(b_val), r'x' * 1000)
+
+        # kept as is when compressing does not pay off
+        b_val = dumps_value(_registry.get(r'raw'), bytes(range(200)), 100)
+
+        self.assertEqual(b_val[0], 0x01)
+        self.assertEqual(loads_value(b_val), bytes(range(200)))
+
+    def test_legacy_zlib_pickle(self):
+
+        val = {r'old': 1}
+
+        self.assertEqual(loads_value(zlib.compress(pickle.dumps(val))), val)
+
+    def test_bad_values(self):
+
+        self.assertIsNone(loads_value(None))
+
+        with self.assertRaises(SerializeError):
+            loads_value(b'')
+
+        with self.assertRaises(SerializeError):
+            loads_value(b'\x7e')
+
+    def test_raw_rejects_other_types(self):
+
+        serializer = _registry.get(r'raw')
+
+        self.assertEqual(serializer.dumps(r'é'), r'é'.encode(r'utf-8'))
+        self.assertEqual(serializer.dumps(memoryview(b'ab')), b'ab')
+
+        for val in (5, None, {r'a': 1}):
+            with self.assertRaises(TypeError):
+                serializer.dumps(val)
+
+    def test_register_code(self):
+
+        class LegacyTag(BaseSerializer):
+            name = r'legacy'
+            code = 0x78
+
+        with self.assertRaises(ValueError):
+            _registry.register(LegacyTag())
+
+
+if __name__ == r'__main__':
+    unittest.main()
@@ -0,0 +1,133 @@
+
+import random
+import asyncio
+import unittest
+
+from util.timer import TimerWheel
+
+
+class TimerWheelTest(unittest.TestCase):
+
+    def setUp(self):
+
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+        self.fired = []
+
+    def tearDown(self):
+
+        self.loop.close()
+        asyncio.set_event_loop(None)
+
+    def advance(self, wheel, ticks):
+
+        # one tick at a time, as _on_tick does, without waiting for the loop
+        for _ in range(ticks):
+            wheel._advance()
+
+    def fire(self, name, wheel):
+
+        self.fired.append((name, wheel.current))
+
+    def test_delay_rounds_up_to_the_tick(self):
+
+        wheel = TimerWheel(1.0)
+
+        wheel.arm(2.5, self.fire, r'a', wheel)
+        wheel.arm(0, self.fire, r'b', wheel)
+
+        self.advance(wheel, 5)
+
+        self.assertEqual(self.fired, [(r'b', 1), (r'a', 3)])
+        self.assertEqual(wheel.count, 0)
+
+    def test_cancel_and_rearm(self):
+
+        wheel = TimerWheel(1.0)
+
+        cancelled = wheel.arm(2, self.fire, r'cancelled', wheel)
+        moved = wheel.arm(2, self.fire, r'moved', wheel)
+
+        cancelled.cancel()
+        cancelled.cancel()
+        wheel.rearm(moved, 4)
+
+        self.assertFalse(cancelled.active)
+        self.assertEqual(wheel.count, 1)
+
+        self.advance(wheel, 5)
+
+        self.assertEqual(self.fired, [(r'moved', 4)])
+        self.assertFalse(moved.active)
+
+    def test_cascade(self):
+
+        wheel = TimerWheel(1.0, slot_bits=2, levels=3)
+
+        deadlines = [1, 3, 4, 5, 15, 16, 17, 40, 63]
+
+        for deadline in deadlines:
+            wheel.arm(deadline, self.fire, deadline, wheel)
+
+        self.advance(wheel, 63)
+
+        self.assertEqual(self.fired, [(deadline, deadline) for deadline in deadlines])
+
+    def test_random_deadlines(self):
+
+        wheel = TimerWheel(1.0, slot_bits=3, levels=4)
+        rand = random.Random(7)
+
+        timers = {}
+
+        for index in range(500):
+            delay = rand.randint(1, 2000)
+            timers[index] = (wheel.arm(delay, self.fire, index, wheel), delay)
+
+        # rearm some from a later tick
+        self.advance(wheel, 100)
+
+        for index in range(0, 500, 3):
+            timer, delay = timers[index]
+            if timer.active:
+                delay = rand.randint(1, 1000)
+                wheel.rearm(timer, delay)
+                timers[index] = (timer, wheel.current + delay)
+
+        self.advance(wheel, 2000)
+
+        self.assertEqual(len(self.fired), 500)
+
+        for index, current in self.fired:
+            self.assertEqual(current, timers[index][1], index)
+
+    def test_callback_error(self):
+
+        wheel = TimerWheel(1.0)
+
+        def fail():
+            raise ValueError(r'callback error')
+
+        wheel.arm(1, fail)
+        wheel.arm(1, self.fire, r'a', wheel)
+
+        self.advance(wheel, 1)
+
+        self.assertEqual(self.fired, [(r'a', 1)])
+
+    def test_loop_driven(self):
+
+        wheel = TimerWheel(0.01)
+
+        wheel.arm(0.03, self.fire, r'a', wheel)
+
+        self.loop.run_until_complete(asyncio.sleep(0.1))
+
+        self.assertEqual([name for name, _ in self.fired], [r'a'])
+        # the wheel stops once it has no timers
+        self.assertIsNone(wheel._handle)
+
+
+if __name__ == r'__main__':
+    unittest.main()
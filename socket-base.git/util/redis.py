@@ -8,18 +8,30 @@ aioredis=1.1.0
 
 """
 
+import json
+import time
+import bisect
+import uuid
 import pickle
 import zlib
 import asyncio
 import aioredis
 
+from collections import OrderedDict
+
 from .util import app_log
+from .serializer import SerializerRegistry, dumps_value, loads_value
 
 
 _DEFAULT_CONFIG = {
     r'expire': 0,
     r'key_prefix': r'',
     r'channel_prefix': r'',
+    # serializer of cached values: raw, json, msgpack, pickle
+    r'serializer': r'pickle',
+    # values are zlib compressed from this size on, 0 never compresses
+    r'compress_threshold': 1024,
+    r'compress_level': 6,
 }
 
 def config_redis_default(**config):
@@ -27,14 +39,204 @@ def config_redis_default(**config):
     _DEFAULT_CONFIG.update(config)
 
 
+def local_cache_channel():
+
+    return _DEFAULT_CONFIG[r'channel_prefix'] + r'local_cache_invalidate'
+
+
+_MISSING = object()
+
+
+class LocalCache(object):
+    """
+    in process LRU in front of redis, with a ttl per entry
+
+    it holds the deserialized values and hands out the same objects to every caller,
+    so only the clients of pool.get_client(local_cache=True) read it,
+    and those must never modify the values they get
+
+    set / delete / expire of a key by any client on any node publish the key on local_cache_channel()
+    in the pipeline of the write, every node drops it from its own LocalCache
+    """
+
+    def __init__(self, max_size, ttl):
+
+        self.max_size = max_size
+        self.ttl = ttl
+
+        # tells the invalidation messages of this process from the others
+        self.node = uuid.uuid4().hex
+
+        # key => (expire_time, val), least recently used first
+        self._entries = OrderedDict()
+
+        # bumped by every invalidation, a fetch takes it before asking redis
+        self.version = 0
+
+        # key => version of its latest invalidation, oldest first,
+        # a value fetched across an invalidation of its own key is not cached
+        self._invalidated = OrderedDict()
+        self._invalidated_size = max(1024, max_size)
+
+        # fetches older than this are not cached at all, raised when _invalidated forgets a key and by clear
+        self._floor = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, key):
+
+        entry = self._entries.get(key, None)
+
+        if entry is not None:
+
+            if entry[0] > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+
+            del self._entries[key]
+
+        self.misses += 1
+
+        return _MISSING
+
+    def set(self, key, val, version):
+
+        if version < self._floor or self._invalidated.get(key, 0) > version:
+            return
+
+        entries = self._entries
+
+        entries[key] = (time.monotonic() + self.ttl, val)
+        entries.move_to_end(key)
+
+        while len(entries) > self.max_size:
+            entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, keys):
+
+        self.version += 1
+
+        invalidated = self._invalidated
+
+        for key in keys:
+
+            invalidated[key] = self.version
+            invalidated.move_to_end(key)
+
+            if self._entries.pop(key, None) is not None:
+                self.invalidations += 1
+
+        while len(invalidated) > self._invalidated_size:
+            _, self._floor = invalidated.popitem(last=False)
+
+    def clear(self):
+
+        self.version += 1
+
+        self._floor = self.version
+
+        self._invalidated.clear()
+        self._entries.clear()
+
+    def get_status(self):
+
+        return {
+            r'size': len(self._entries),
+            r'max_size': self.max_size,
+            r'hits': self.hits,
+            r'misses': self.misses,
+            r'evictions': self.evictions,
+            r'invalidations': self.invalidations,
+        }
+
+
+class WaitHistogram(object):
+    """
+    counts of wait times per bucket, bounds in seconds, the last bucket takes the rest
+    """
+
+    def __init__(self, bounds=(0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1)):
+
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def add(self, seconds):
+
+        self.counts[bisect.bisect_left(self.bounds, seconds)] += 1
+
+        self.count += 1
+        self.total += seconds
+
+        if seconds > self.max:
+            self.max = seconds
+
+    def get_status(self):
+
+        buckets = OrderedDict()
+
+        for bound, count in zip(self.bounds, self.counts):
+            buckets[r'<={}'.format(bound)] = count
+
+        buckets[r'>{}'.format(self.bounds[-1])] = self.counts[-1]
+
+        return {
+            r'count': self.count,
+            r'avg': self.total / self.count if self.count else 0,
+            r'max': self.max,
+            r'buckets': buckets,
+        }
+
+
+class Lease(object):
+
+    __slots__ = (r'_owner', r'conn', r'start')
+
+    def __init__(self, owner, conn, start):
+
+        self._owner = owner
+        self.conn = conn
+        self.start = start
+
+    def __enter__(self):
+
+        return self.conn
+
+    def __exit__(self, exc_type, exc_value, traceback):
+
+        self._owner._end_lease(self)
+
+
 class BaseRedisPool(object):
 
-    def __init__(self, addr, settings):
+    def __init__(self, addr, settings, auto_pipeline=False, local_cache_size=0, local_cache_ttl=5, lease_timeout=10):
 
         self._addr = addr
         self._settings = settings
         self._pool = None
 
+        # leases held longer than lease_timeout seconds are reported as leaked
+        self._leases = set()
+        self._lease_timeout = lease_timeout
+        self._acquire_wait = WaitHistogram()
+
+        # batch the commands of one loop iteration into one pipeline
+        self._auto_pipeline = auto_pipeline
+        self._pipeline = None
+
+        if local_cache_size > 0:
+            self._local_cache = LocalCache(local_cache_size, local_cache_ttl)
+        else:
+            self._local_cache = None
+
     @asyncio.coroutine
     def initialize(self):
 
@@ -42,19 +244,100 @@ class BaseRedisPool(object):
 
             self._pool = yield from aioredis.create_pool(self._addr, **self._settings)
 
+            if self._auto_pipeline:
+                self._pipeline = AutoPipeline(self)
+
             app_log.info(r'MCachePool initialized')
 
-    def get_client(self):
+    @asyncio.coroutine
+    def acquire(self):
+        """
+        a connection kept for long, like the pubsub connection, it is not tracked as a lease
+        """
+
+        conn = yield from self._pool.acquire()
+
+        return conn
+
+    def release(self, conn):
+
+        self._pool.release(conn)
+
+    @asyncio.coroutine
+    def lease(self):
+        """
+        the connection goes back to the pool when the block exits, also when a command raises
+
+            with (yield from pool.lease()) as conn:
+                yield from conn.get(key)
+        """
+
+        start = time.monotonic()
+
+        conn = yield from self._pool.acquire()
+
+        now = time.monotonic()
+
+        self._acquire_wait.add(now - start)
+
+        lease = Lease(self, conn, now)
+
+        self._leases.add(lease)
+
+        return lease
+
+    def _end_lease(self, lease):
+
+        self._leases.discard(lease)
+
+        self._pool.release(lease.conn)
+
+    def get_client(self, serializer=None, local_cache=False):
+        """
+        local_cache: get / mget of the client read and fill the LocalCache of the pool,
+        the values are then shared with the other such clients and must not be modified
+        """
+
+        return CacheClient(self, self._pipeline, serializer, self._local_cache, local_cache)
+
+    @asyncio.coroutine
+    def subscribe_invalidation(self, event_bus):
+        """
+        drop the keys other nodes changed from the local cache
+        """
+
+        if self._local_cache is not None:
+            yield from event_bus.subscribe(local_cache_channel(), self._on_invalidate)
+
+    @asyncio.coroutine
+    def _on_invalidate(self, message):
 
-        return CacheClient(self._pool)
+        if message.get(r'node', None) != self._local_cache.node:
+            self._local_cache.invalidate(message.get(r'keys', ()))
+
+    def get_local_cache_status(self):
+
+        if self._local_cache is None:
+            return None
+
+        return self._local_cache.get_status()
 
     def get_conn_status(self):
 
+        now = time.monotonic()
+
+        lease_ages = [now - lease.start for lease in self._leases]
+
         conn_status = {
             r'max_conn': self._pool.maxsize,
             r'min_conn': self._pool.minsize,
             r'conn_num': self._pool.size,
             r'idle_num': self._pool.freesize,
+            r'in_use_num': self._pool.size - self._pool.freesize,
+            r'lease_num': len(lease_ages),
+            r'leaked_num': sum(1 for age in lease_ages if age >= self._lease_timeout),
+            r'oldest_lease': max(lease_ages, default=0),
+            r'acquire_wait': self._acquire_wait.get_status(),
             r'db': self._pool.db
         }
 
@@ -144,22 +427,185 @@ class BaseEventBus(object):
 
 
 
-class CacheClient(object):
+class AutoPipeline(object):
+    """
+    commands issued by any coroutine during one loop iteration are sent to redis
+    in one pipeline on one pooled connection, every caller gets the result of its own command
+    """
 
     def __init__(self, pool):
 
         self._pool = pool
+        self._commands = []
+        self._sender = None
 
     @asyncio.coroutine
-    def _acquire_conn(self):
+    def execute(self, command, *args, **kwargs):
 
-        conn = yield from self._pool.acquire()
+        future = asyncio.Future()
 
-        return conn
+        self._commands.append((command, args, kwargs, future))
 
-    def _release_conn(self, conn):
+        if self._sender is None:
+            # the sender starts on the next loop iteration, it takes every command queued until then
+            loop = asyncio.get_event_loop()
+            self._sender = loop.create_task(self._send())
 
-        self._pool.release(conn)
+        result = yield from future
+
+        return result
+
+    @asyncio.coroutine
+    def _send(self):
+
+        commands, self._commands = self._commands, []
+
+        self._sender = None
+
+        try:
+
+            with (yield from self._pool.lease()) as conn:
+
+                pipe = conn.pipeline()
+
+                for command, args, kwargs, _ in commands:
+                    getattr(pipe, command)(*args, **kwargs)
+
+                results = yield from pipe.execute(return_exceptions=True)
+
+        except Exception as e:
+
+            self._set_exception(commands, e)
+
+        else:
+
+            for (_, _, _, future), result in zip(commands, results):
+                if future.done():
+                    # the caller was cancelled
+                    continue
+                if isinstance(result, Exception):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+
+    @staticmethod
+    def _set_exception(commands, error):
+
+        for _, _, _, future in commands:
+            if not future.done():
+                future.set_exception(error)
+
+
+class CacheClient(object):
+
+    def __init__(self, pool, pipeline=None, serializer=None, local_cache=None, read_local_cache=False):
+
+        self._pool = pool
+        self._pipeline = pipeline
+
+        # every client invalidates on writes, only the opted in clients read
+        self._local_cache = local_cache
+        self._read_local_cache = read_local_cache and local_cache is not None
+
+        if serializer is None:
+            serializer = _DEFAULT_CONFIG[r'serializer']
+
+        self._serializer = SerializerRegistry().get(serializer)
+
+        if self._serializer is None:
+            raise ValueError(r'serializer {} not supported'.format(serializer))
+
+    @asyncio.coroutine
+    def _execute(self, command, *args, **kwargs):
+        """
+        run one redis command, through the auto pipeline when the pool has one
+        """
+
+        if self._pipeline is not None:
+            result = yield from self._pipeline.execute(command, *args, **kwargs)
+            return result
+
+        with (yield from self._pool.lease()) as conn:
+
+            result = yield from getattr(conn, command)(*args, **kwargs)
+
+        return result
+
+    @asyncio.coroutine
+    def _execute_many(self, commands):
+        """
+        run [(command, args, kwargs), ...] in one pipeline, results in the same order,
+        the first failed command raises
+        """
+
+        if self._pipeline is not None:
+            results = yield from asyncio.gather(
+                *[self._pipeline.execute(command, *args, **kwargs) for command, args, kwargs in commands]
+            )
+            return results
+
+        with (yield from self._pool.lease()) as conn:
+
+            pipe = conn.pipeline()
+
+            for command, args, kwargs in commands:
+                getattr(pipe, command)(*args, **kwargs)
+
+            results = yield from pipe.execute(return_exceptions=True)
+
+        for result in results:
+            if isinstance(result, Exception):
+                raise result
+
+        return results
+
+    @asyncio.coroutine
+    def _write(self, commands, keys):
+        """
+        run the write commands of keys in one pipeline, results in the same order,
+        the publish dropping keys from the local cache of every node goes in the same pipeline
+        """
+
+        local_cache = self._local_cache
+
+        if local_cache is None:
+
+            if len(commands) == 1:
+                command, args, kwargs = commands[0]
+                result = yield from self._execute(command, *args, **kwargs)
+                return [result]
+
+            results = yield from self._execute_many(commands)
+            return results
+
+        message = bytes(json.dumps({r'node': local_cache.node, r'keys': keys}), r'utf-8')
+
+        try:
+
+            results = yield from self._execute_many(
+                commands + [(r'publish', (local_cache_channel(), message), {})]
+            )
+
+        finally:
+
+            # dropped even if the write failed, it may still have been applied
+            local_cache.invalidate(keys)
+
+        return results[:-1]
+
+    def dumps(self, val):
+
+        return dumps_value(
+            self._serializer, val, _DEFAULT_CONFIG[r'compress_threshold'], _DEFAULT_CONFIG[r'compress_level']
+        )
+
+    @staticmethod
+    def loads(val):
+        """
+        reads every serializer and the untagged values of pickle_dumps_zip
+        """
+
+        return loads_value(val)
 
     @staticmethod
     def pickle_dumps_zip(val):
@@ -189,15 +635,26 @@ class CacheClient(object):
 
         key = _DEFAULT_CONFIG[r'key_prefix'] + key
 
-        try:
+        local_cache = self._local_cache if self._read_local_cache else None
+
+        if local_cache is not None:
+
+            result = local_cache.get(key)
+
+            if result is not _MISSING:
+                return result
 
-            conn = yield from self._acquire_conn()
+            result = None
+            version = local_cache.version
 
-            b_val = yield from conn.get(key)
+        try:
+
+            b_val = yield from self._execute(r'get', key)
 
-            result = self.unzip_pickle_loads(b_val)
+            result = self.loads(b_val)
 
-            self._release_conn(conn)
+            if local_cache is not None and b_val is not None:
+                local_cache.set(key, result, version)
 
         except Exception as e:
 
@@ -217,16 +674,12 @@ class CacheClient(object):
 
         try:
 
-            conn = yield from self._acquire_conn()
-
-            b_val = self.pickle_dumps_zip(val)
+            b_val = self.dumps(val)
 
-            yield from conn.set(key, b_val, expire=expire)
+            yield from self._write([(r'set', (key, b_val), {r'expire': expire})], [key])
 
             result = True
 
-            self._release_conn(conn)
-
         except Exception as e:
 
             app_log.exception(r'cache set: {}'.format(e))
@@ -240,11 +693,7 @@ class CacheClient(object):
 
         try:
 
-            conn = yield from self._acquire_conn()
-
-            yield from conn.delete(key)
-
-            self._release_conn(conn)
+            yield from self._write([(r'delete', (key,), {})], [key])
 
         except Exception as e:
 
@@ -258,11 +707,7 @@ class CacheClient(object):
             if isinstance(content, str):
                 content = bytes(content, r'utf-8')
 
-            conn = yield from self._acquire_conn()
-
-            yield from conn.publish(channel, content)
-
-            self._release_conn(conn)
+            yield from self._execute(r'publish', channel, content)
 
         except Exception as e:
 
@@ -275,11 +720,7 @@ class CacheClient(object):
 
         try:
 
-            conn = yield from self._acquire_conn()
-
-            yield from conn.expire(key, expire)
-
-            self._release_conn(conn)
+            yield from self._write([(r'expire', (key, expire), {})], [key])
 
         except Exception as e:
 
@@ -294,15 +735,11 @@ class CacheClient(object):
 
         try:
 
-            conn = yield from self._acquire_conn()
-
-            ttl_second = yield from conn.ttl(key)
+            ttl_second = yield from self._execute(r'ttl', key)
 
             if ttl_second > 0:
                 result = ttl_second
 
-            self._release_conn(conn)
-
         except Exception as e:
 
             app_log.exception(r'cache ttl: {}'.format(e))
@@ -318,17 +755,147 @@ class CacheClient(object):
 
         try:
 
-            conn = yield from self._acquire_conn()
-
-            setnx_result = yield from conn.setnx(key, val)
+            setnx_result = yield from self._execute(r'setnx', key, val)
 
             if setnx_result:
                 result = True 
 
-            self._release_conn(conn)
-
         except Exception as e:
 
             app_log.exception(r'cache setnx: {}'.format(e))
 
         return result
+
+    @asyncio.coroutine
+    def mget(self, keys):
+        """
+        returns {key: val} of all keys in one command, val is None for missing keys
+        """
+
+        result = {}
+
+        if not keys:
+            return result
+
+        key_prefix = _DEFAULT_CONFIG[r'key_prefix']
+
+        local_cache = self._local_cache if self._read_local_cache else None
+
+        if local_cache is not None:
+
+            for key in keys:
+                val = local_cache.get(key_prefix + key)
+                if val is not _MISSING:
+                    result[key] = val
+
+            keys = [key for key in keys if key not in result]
+
+            if not keys:
+                return result
+
+            version = local_cache.version
+
+        try:
+
+            b_vals = yield from self._execute(r'mget', *[key_prefix + key for key in keys])
+
+            for key, b_val in zip(keys, b_vals):
+
+                val = result[key] = self.loads(b_val)
+
+                if local_cache is not None and b_val is not None:
+                    local_cache.set(key_prefix + key, val, version)
+
+        except Exception as e:
+
+            app_log.exception(r'cache mget: {}'.format(e))
+
+        return result
+
+    @asyncio.coroutine
+    def mset(self, mapping, expire=None):
+        """
+        set {key: val} at once, expire is one expire for all keys or {key: expire}
+        keys without an expire are set in one command, the others in one pipeline
+        """
+
+        if not mapping:
+            return True
+
+        if expire is None:
+            expire = _DEFAULT_CONFIG[r'expire']
+
+        result = None
+
+        key_prefix = _DEFAULT_CONFIG[r'key_prefix']
+
+        try:
+
+            b_vals = [(key, self.dumps(val)) for key, val in mapping.items()]
+
+            if isinstance(expire, dict):
+                expires = [expire.get(key, _DEFAULT_CONFIG[r'expire']) for key, _ in b_vals]
+            else:
+                expires = [expire] * len(b_vals)
+
+            if not any(expires):
+
+                args = []
+                for key, b_val in b_vals:
+                    args.append(key_prefix + key)
+                    args.append(b_val)
+
+                commands = [(r'mset', args, {})]
+
+            else:
+
+                commands = [
+                    (r'set', (key_prefix + key, b_val), {r'expire': key_expire})
+                    for (key, b_val), key_expire in zip(b_vals, expires)
+                ]
+
+            yield from self._write(commands, [key_prefix + key for key, _ in b_vals])
+
+            result = True
+
+        except Exception as e:
+
+            app_log.exception(r'cache mset: {}'.format(e))
+
+        return result
+
+    @asyncio.coroutine
+    def mdelete(self, keys):
+
+        if not keys:
+            return
+
+        key_prefix = _DEFAULT_CONFIG[r'key_prefix']
+
+        try:
+
+            prefixed = [key_prefix + key for key in keys]
+
+            yield from self._write([(r'delete', prefixed, {})], prefixed)
+
+        except Exception as e:
+
+            app_log.exception(r'cache mdelete: {}'.format(e))
+
+    @asyncio.coroutine
+    def mexpire(self, keys, expire):
+
+        if not keys:
+            return
+
+        key_prefix = _DEFAULT_CONFIG[r'key_prefix']
+
+        try:
+
+            prefixed = [key_prefix + key for key in keys]
+
+            yield from self._write([(r'expire', (key, expire), {}) for key in prefixed], prefixed)
+
+        except Exception as e:
+
+            app_log.exception(r'cache mexpire: {}'.format(e))
@@ -0,0 +1,170 @@
+
+import json
+import zlib
+import pickle
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+from .util import Singleton
+
+
+# value = tag(u8) payload
+# the low bits of the tag are the serializer code, _FLAG_COMPRESSED means the payload is zlib compressed
+# values written before the tag existed are zlib compressed pickles, they start with 0x78,
+# no tag is 0x78, so both formats can be read while the old values expire
+_FLAG_COMPRESSED = 0x80
+_CODE_MASK = 0x7f
+_LEGACY_ZLIB = 0x78
+
+
+class SerializeError(Exception):
+    pass
+
+
+class BaseSerializer(object):
+    """
+    name: name given to the cache client
+    code: tag of the stored value, 1 - 0x7f
+    """
+
+    name = None
+    code = None
+
+    def dumps(self, val):
+        raise NotImplementedError()
+
+    def loads(self, b_val):
+        raise NotImplementedError()
+
+
+class RawSerializer(BaseSerializer):
+
+    name = r'raw'
+    code = 1
+
+    def dumps(self, val):
+        if isinstance(val, str):
+            return val.encode(r'utf-8')
+        if isinstance(val, (bytes, bytearray, memoryview)):
+            return bytes(val)
+        # bytes(5) would store five zero bytes
+        raise TypeError(r'raw serializer takes str or bytes, not {}'.format(type(val).__name__))
+
+    def loads(self, b_val):
+        return bytes(b_val)
+
+
+class JsonSerializer(BaseSerializer):
+
+    name = r'json'
+    code = 2
+
+    def dumps(self, val):
+        return json.dumps(val, separators=(r',', r':')).encode(r'utf-8')
+
+    def loads(self, b_val):
+        return json.loads(str(b_val, r'utf-8'))
+
+
+class MsgpackSerializer(BaseSerializer):
+
+    name = r'msgpack'
+    code = 3
+
+    def dumps(self, val):
+        return msgpack.packb(val, use_bin_type=True)
+
+    def loads(self, b_val):
+        return msgpack.unpackb(b_val, raw=False)
+
+
+class PickleSerializer(BaseSerializer):
+
+    name = r'pickle'
+    code = 4
+
+    def dumps(self, val):
+        return pickle.dumps(val, pickle.HIGHEST_PROTOCOL)
+
+    def loads(self, b_val):
+        return pickle.loads(b_val)
+
+
+class SerializerRegistry(Singleton):
+
+    def __init__(self):
+
+        # name => serializer
+        self.serializers = {}
+        # code => serializer
+        self.codes = {}
+
+    def register(self, serializer):
+
+        if not 0 < serializer.code <= _CODE_MASK or serializer.code == _LEGACY_ZLIB:
+            raise ValueError(r'serializer code {} not allowed'.format(serializer.code))
+
+        self.serializers[serializer.name] = serializer
+        self.codes[serializer.code] = serializer
+
+    def get(self, name):
+
+        return self.serializers.get(name, None)
+
+
+def dumps_value(serializer, val, compress_threshold, compress_level=6):
+    """
+    serialize val with the tag of serializer, the payload is compressed from compress_threshold bytes on
+    if compressing pays off, compress_threshold 0 never compresses
+    """
+
+    payload = serializer.dumps(val)
+
+    tag = serializer.code
+
+    if compress_threshold and len(payload) >= compress_threshold:
+        compressed = zlib.compress(payload, compress_level)
+        if len(compressed) < len(payload):
+            payload = compressed
+            tag |= _FLAG_COMPRESSED
+
+    return bytes((tag,)) + payload
+
+
+def loads_value(b_val):
+
+    if b_val is None:
+        return None
+
+    if not b_val:
+        raise SerializeError(r'empty value')
+
+    tag = b_val[0]
+
+    if tag == _LEGACY_ZLIB:
+        return pickle.loads(zlib.decompress(b_val))
+
+    serializer = _registry.codes.get(tag & _CODE_MASK, None)
+
+    if serializer is None:
+        raise SerializeError(r'serializer code {} not supported'.format(tag & _CODE_MASK))
+
+    payload = memoryview(b_val)[1:]
+
+    if tag & _FLAG_COMPRESSED:
+        payload = zlib.decompress(payload)
+
+    return serializer.loads(payload)
+
+
+_registry = SerializerRegistry()
+
+_registry.register(RawSerializer())
+_registry.register(JsonSerializer())
+_registry.register(PickleSerializer())
+
+if msgpack is not None:
+    _registry.register(MsgpackSerializer())
@@ -0,0 +1,163 @@
+
+import math
+import asyncio
+
+from .util import app_log
+
+
+class Timer(object):
+
+    __slots__ = (r'deadline', r'callback', r'args', r'_wheel', r'_slot')
+
+    def __init__(self, wheel, deadline, callback, args):
+
+        self.deadline = deadline
+        self.callback = callback
+        self.args = args
+
+        self._wheel = wheel
+        self._slot = None
+
+    @property
+    def active(self):
+
+        return self._slot is not None
+
+    def cancel(self):
+
+        if self._slot is not None:
+            self._slot.discard(self)
+            self._slot = None
+            self._wheel.count -= 1
+
+
+class TimerWheel(object):
+    """
+    hierarchical timer wheel, arm / rearm / cancel are O(1)
+
+    level 0 has one slot per tick, every slot of level n covers all the slots of level n-1,
+    timers of a higher level cascade down when the lower level wraps around
+
+    the wheel keeps one loop.call_later handle for all its timers and only while it has timers,
+    so 100k connection timers do not sit in the event loop heap
+    """
+
+    def __init__(self, tick=1.0, slot_bits=6, levels=4):
+
+        self.tick = tick
+        self.count = 0
+        # ticks elapsed since the wheel started
+        self.current = 0
+
+        self._slot_bits = slot_bits
+        self._slot_mask = (1 << slot_bits) - 1
+        self._levels = [[set() for _ in range(1 << slot_bits)] for _ in range(levels)]
+        self._max_ticks = (1 << (slot_bits * levels)) - 1
+
+        self._start_time = None
+        self._handle = None
+
+    def ticks(self, delay):
+
+        return min(max(1, math.ceil(delay / self.tick)), self._max_ticks)
+
+    def arm(self, delay, callback, *args):
+        """
+        call callback(*args) after delay seconds, rounded up to the tick
+        """
+
+        timer = Timer(self, 0, callback, args)
+
+        self.rearm(timer, delay)
+
+        return timer
+
+    def rearm(self, timer, delay):
+
+        timer.cancel()
+
+        timer.deadline = self.current + self.ticks(delay)
+
+        self._place(timer)
+
+        self.count += 1
+
+        if self._handle is None:
+            self._start()
+
+    def _place(self, timer):
+
+        bits = self._slot_bits
+
+        delta = timer.deadline - self.current
+
+        level = 0
+        while delta >> (bits * (level + 1)) and level < len(self._levels) - 1:
+            level += 1
+
+        slot = self._levels[level][(timer.deadline >> (bits * level)) & self._slot_mask]
+        slot.add(timer)
+        timer._slot = slot
+
+    def _start(self):
+
+        loop = asyncio.get_event_loop()
+
+        now = loop.time()
+
+        if self._start_time is None:
+            self._start_time = now
+        else:
+            # nothing was armed while stopped, skip the idle ticks at once
+            self._start_time = now - self.current * self.tick
+
+        self._handle = loop.call_later(self.tick, self._on_tick)
+
+    def _on_tick(self):
+
+        loop = asyncio.get_event_loop()
+
+        now_tick = int((loop.time() - self._start_time) / self.tick)
+
+        while self.current < now_tick and self.count:
+            self._advance()
+
+        if self.count:
+            delay = self._start_time + (self.current + 1) * self.tick - loop.time()
+            self._handle = loop.call_later(max(delay, 0), self._on_tick)
+        else:
+            self.current = max(self.current, now_tick)
+            self._handle = None
+
+    def _advance(self):
+
+        self.current += 1
+
+        current = self.current
+        bits = self._slot_bits
+        mask = self._slot_mask
+
+        # levels whose lower level wrapped around, cascade from the top so nothing skips a round
+        level = 0
+        while level < len(self._levels) - 1 and not (current >> (bits * level)) & mask:
+            level += 1
+
+        for index in range(level, 0, -1):
+            slot = self._levels[index][(current >> (bits * index)) & mask]
+            if slot:
+                timers = list(slot)
+                slot.clear()
+                for timer in timers:
+                    self._place(timer)
+
+        slot = self._levels[0][current & mask]
+
+        for timer in list(slot):
+            if timer._slot is not slot or timer.deadline != current:
+                # cancelled or rearmed by an earlier callback
+                continue
+            timer.cancel()
+            try:
+                timer.callback(*timer.args)
+            except Exception as e:
+                app_log.exception(r'timer callback error, {}'.format(e))